@@ -0,0 +1,95 @@
+"""
+Comprobación automática del backend HTTP (OJD_BACKEND=http) contra bench/mock_ojd.py y
+la página grabada: login replicado, reutilización de la cookie de sesión cacheada, nuevo
+login si caduca y fecha devuelta por la página. Sale con código 1 si algo no cuadra.
+
+  python bench/check_http.py
+"""
+import os, re, sys, json, pathlib, tempfile
+from datetime import datetime
+
+BENCH_DIR = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+import mock_ojd
+from corpus import with_date
+
+SRV = mock_ojd.serve(0)
+BASE = f"http://127.0.0.1:{SRV.server_address[1]}"
+TMP_DIR = tempfile.TemporaryDirectory(prefix="ojd_check_")
+TMP = pathlib.Path(TMP_DIR.name)
+os.environ.update({"OJD_BASE_URL": BASE, "OJD_USER": mock_ojd.MOCK_USER, "OJD_PASS": mock_ojd.MOCK_PASS,
+                   "SESSION_CACHE": str(TMP / "session.bin"), "SESSION_CACHE_KEY": "", "HISTORY_DB": ""})
+os.chdir(TMP)  # debug/ del exportador fuera del repo
+import ojd_export as ojd
+
+FAILS = []
+
+def check(name: str, ok: bool, detail=""):
+    print(f"[CHECK] {'OK  ' if ok else 'FAIL'} {name}" + (f": {detail}" if not ok and detail else ""))
+    if not ok: FAILS.append(name)
+
+def expected_rows(html: str, fecha: str) -> list[list]:
+    """Filas esperadas leídas de la página sin el parser del exportador: un medio del catálogo por alias exacto."""
+    cells = {m.group(2).strip().lower(): [int(x.replace(".", "")) for x in m.groups()[2:]]
+             for m in re.finditer(r"<tr><td>(\d+)</td><td>(.*?)</td><td>([\d.]+)</td><td>([\d.]+)</td><td>([\d.]+)</td>", html)}
+    media = json.loads((BENCH_DIR.parent / "media.json").read_text(encoding="utf-8"))
+    out = []
+    for m in media:
+        hit = next((cells[a] for a in [m["name"].lower()] + m["aliases"] if a in cells), None)
+        if hit: out.append([fecha, m["name"], *hit])
+    return out
+
+def rows_of(frames) -> list[list]:
+    """Salida de scrape_http como listas (modo LEAN o DataFrames)."""
+    if ojd.LEAN: return [r for f in frames for r in f]
+    return [r for f in frames for r in f.astype(object).where(ojd.pd.notna(f), "").values.tolist()]
+
+def run(dates: list[datetime]):
+    mock_ojd.STATS.clear()
+    frames = ojd.scrape_http(dates)
+    return frames, dict(mock_ojd.STATS)
+
+def main() -> int:
+    d1, d2 = datetime(2026, 10, 13), datetime(2026, 10, 14)
+
+    # 1) Sin sesión cacheada: login replicado (GET + POST con CSRF) y tabla de la página grabada
+    frames, st = run([d1])
+    check("login replicado", frames is not None and st.get("ojd_login_post") == 1, st)
+    # sonda (302 + acceso), envío (POST + TM_URL tras la redirección) y una búsqueda: sin peticiones repetidas
+    check("5 peticiones al portal sin sesión", sum(v for k, v in st.items() if k.startswith("ojd_")) == 5, st)
+    check("sesión guardada", ojd.SESSION_CACHE.exists())
+    if frames is not None:
+        want = expected_rows(mock_ojd.tm_page(ojd.dmy(d1)), ojd.ymd(d1))
+        check("filas de la página grabada", rows_of(frames) == want, f"{rows_of(frames)[:2]} != {want[:2]}")
+
+    # 2) Sesión cacheada válida: ningún login, una búsqueda por fecha
+    frames, st = run([d1, d2])
+    check("cookie de sesión reutilizada", frames is not None and "ojd_login_post" not in st
+          and "ojd_redirect_login" not in st, st)
+    check("una búsqueda por fecha", st.get("ojd_search") == 2, st)
+    check("formulario leído una vez", st.get("ojd_tm_page") == 1, st)
+    if frames is not None:
+        check("dos fechas, en orden", [r[0] for r in rows_of(frames)][::8] == [ojd.ymd(d1), ojd.ymd(d2)])
+
+    # 3) Sesión caducada en el portal: se detecta la redirección y se vuelve a entrar
+    mock_ojd.SESSIONS.clear()
+    frames, st = run([d1])
+    check("nuevo login con sesión caducada", frames is not None and st.get("ojd_login_post") == 1, st)
+
+    # 4) La fecha de las filas es la que devuelve la página (#datepicker), no la pedida
+    orig = mock_ojd.tm_page
+    mock_ojd.tm_page = lambda ddmmyyyy: with_date(orig(ddmmyyyy), "12/10/2026")
+    try:
+        frames, st = run([d1])
+    finally:
+        mock_ojd.tm_page = orig
+    check("fecha devuelta por la página", frames is not None
+          and {r[0] for r in rows_of(frames)} == {"2026-10-12"}, frames)
+
+    SRV.shutdown()
+    os.chdir(BENCH_DIR); TMP_DIR.cleanup()
+    print(f"[CHECK] {'OK' if not FAILS else f'{len(FAILS)} comprobaciones fallidas'}")
+    return 1 if FAILS else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
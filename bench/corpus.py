@@ -0,0 +1,30 @@
+"""Corpus de páginas del portal: las grabadas en bench/pages y réplicas sintéticas grandes."""
+import re, random, pathlib
+
+PAGES_DIR = pathlib.Path(__file__).resolve().parent / "pages"
+ROW_RE = re.compile(r"<tr><td>\d+</td>.*?</tr>", re.S)
+DATE_RE = re.compile(r'(id="datepicker"[^>]*value=")[^"]*(")')
+
+def fmt_es(n: int) -> str:
+    return f"{n:,}".replace(",", ".")
+
+def synth_rows(html: str, rows: int, seed: int = 7) -> str:
+    """Sustituye el tbody por `rows` filas: los nombres grabados con variantes y cifras al azar."""
+    rnd = random.Random(seed)
+    names = re.findall(r"<tr><td>\d+</td><td>(.*?)</td>", html)
+    variants = [lambda n: n, str.upper, lambda n: f" {n} ", lambda n: f"www.{n}", lambda n: f"{n} (total)"]
+    body = []
+    for i in range(1, rows + 1):
+        name = rnd.choice(variants)(rnd.choice(names)) if i > len(names) else names[i - 1]
+        nu = rnd.randint(100, 900_000); v = int(nu * rnd.uniform(1.1, 1.8)); pv = int(v * rnd.uniform(1.5, 3.5))
+        body.append(f"<tr><td>{i}</td><td>{name}</td><td>{fmt_es(nu)}</td><td>{fmt_es(v)}</td>"
+                    f"<td>{fmt_es(pv)}</td><td>00:02:{rnd.randint(10, 59)}</td></tr>")
+    first, last = ROW_RE.search(html), list(ROW_RE.finditer(html))[-1]
+    return html[:first.start()] + "\n".join(body) + html[last.end():]
+
+def with_date(html: str, ddmmyyyy: str) -> str:
+    """La página con otra fecha en #datepicker."""
+    return DATE_RE.sub(lambda m: f"{m.group(1)}{ddmmyyyy}{m.group(2)}", html, count=1)
+
+def recorded_pages() -> dict[str, str]:
+    return {p.stem: p.read_text(encoding="utf-8") for p in sorted(PAGES_DIR.glob("*.html"))}
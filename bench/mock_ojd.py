@@ -0,0 +1,256 @@
+"""
+Portal OJD y API de Google Sheets locales para medir ojd_export.py de punta a punta
+sin red ni credenciales.
+
+Portal: /traffic-monitoring/login (banner de cookies, formulario con CSRF, placeholders
+Usuario/Contraseña y botón Acceder) y la página de traffic monitoring con #datepicker
+(GET ?fecha=dd/mm/yyyy) y la tabla de bench/pages; sin cookie de sesión redirige al login.
+Sheets: /v4/spreadsheets/<id> (metadatos), :batchUpdate (addSheet, updateCells,
+appendDimension) y /values/<rango>, con la rejilla en memoria.
+
+Cuenta las peticiones por ruta (GET /_stats, POST /_reset). Configuración por entorno:
+MOCK_PORT, MOCK_LATENCY_MS (portal), MOCK_SHEETS_LATENCY_MS, MOCK_ROWS (filas de la tabla).
+
+  python bench/mock_ojd.py         # servir (OJD_BASE_URL y SHEETS_API_URL a exportar)
+  python bench/mock_ojd.py e2e     # ejecutar ojd_export.py contra el mock en cada modo de MOCK_E2E_MODES
+"""
+import os, re, sys, time, secrets, tempfile, threading, subprocess, pathlib
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+from json import loads as json_loads, dumps as json_dumps
+
+from corpus import recorded_pages, synth_rows, with_date
+
+# ========================== CONFIG ==========================
+MOCK_PORT = int(os.getenv("MOCK_PORT", "8765"))
+MOCK_LATENCY_MS = int(os.getenv("MOCK_LATENCY_MS", "0"))
+MOCK_SHEETS_LATENCY_MS = int(os.getenv("MOCK_SHEETS_LATENCY_MS", "0"))
+MOCK_ROWS = int(os.getenv("MOCK_ROWS", "0"))  # 0 = las filas grabadas tal cual
+MOCK_USER = os.getenv("MOCK_USER", "demo")
+MOCK_PASS = os.getenv("MOCK_PASS", "demo")
+# Modos e2e: nombre=VAR=valor,VAR=valor;... (se suman al entorno de ojd_export.py;
+# "daily" vacía BACKFILL_RANGE: una sola fecha, ruta LEAN)
+MOCK_E2E_MODES = os.getenv("MOCK_E2E_MODES",
+    "daily=OJD_BACKEND=http,BACKFILL_RANGE=;http=OJD_BACKEND=http;sync=OJD_ENGINE=sync;"
+    "async=OJD_ENGINE=async,BACKFILL_WORKERS=3;backfill3=BACKFILL_WORKERS=3")
+MOCK_E2E_RANGE = os.getenv("MOCK_E2E_RANGE", "")  # por defecto, los 7 días hasta hoy-2
+
+TM_PATH = "/traffic-monitoring/traffic-monitoring/0/"
+LOGIN_PATH = "/traffic-monitoring/login"
+
+LOGIN_HTML = """<!DOCTYPE html><html lang="es"><head><meta charset="utf-8"><title>Acceso | OJD Interactiva</title></head>
+<body><div id="cookies"><p>Usamos cookies.</p>
+<button type="button" onclick="this.parentNode.remove()">Aceptar todo</button></div>
+<form method="post" action="{action}"><input type="hidden" name="_csrf" value="{csrf}">
+<input type="text" name="_username" placeholder="Usuario"><input type="password" name="_password" placeholder="Contraseña">
+<button type="submit">Acceder</button></form></body></html>"""
+
+# ========================== ESTADO ==========================
+STATS = Counter()
+_lock = threading.Lock()
+SESSIONS, CSRF = set(), set()
+SHEETS = {}  # título -> {"id", "rows": filas, "grid": [[valor]]}
+_page_cache = {}
+
+def hit(key: str):
+    with _lock: STATS[key] += 1
+
+def tm_page(ddmmyyyy: str) -> str:
+    """Página de traffic monitoring para la fecha (cifras estables por fecha, distintas entre fechas)."""
+    if ddmmyyyy not in _page_cache:
+        html = next(iter(recorded_pages().values()))
+        rows = MOCK_ROWS or len(re.findall(r"<tr><td>\d+</td>", html))
+        seed = int(re.sub(r"\D", "", ddmmyyyy) or 0)
+        _page_cache[ddmmyyyy] = with_date(synth_rows(html, rows, seed=seed), ddmmyyyy)
+    return _page_cache[ddmmyyyy]
+
+def default_dmy() -> str:
+    return (datetime.now() - timedelta(days=2)).strftime("%d/%m/%Y")
+
+# ========================== SHEETS ==========================
+def sheet_props(title: str) -> dict:
+    s = SHEETS[title]
+    return {"sheetId": s["id"], "title": title, "index": list(SHEETS).index(title), "sheetType": "GRID",
+            "gridProperties": {"rowCount": s["rows"], "columnCount": 26}}
+
+def add_sheet(title: str, rows: int = 1000) -> dict:
+    SHEETS.setdefault(title, {"id": len(SHEETS), "rows": rows, "grid": []})
+    return sheet_props(title)
+
+def by_id(sheet_id: int) -> dict:
+    return next(s for s in SHEETS.values() if s["id"] == sheet_id)
+
+def cell_value(c: dict):
+    v = c.get("userEnteredValue", {})
+    return v.get("numberValue", v.get("stringValue", ""))
+
+def apply_request(req: dict) -> dict:
+    if "addSheet" in req:
+        p = req["addSheet"]["properties"]
+        return {"addSheet": {"properties": add_sheet(p["title"], p.get("gridProperties", {}).get("rowCount", 1000))}}
+    if "appendDimension" in req:
+        by_id(req["appendDimension"]["sheetId"])["rows"] += req["appendDimension"]["length"]
+    elif "updateCells" in req:
+        uc = req["updateCells"]
+        if "range" in uc:
+            by_id(uc["range"]["sheetId"])["grid"] = []
+        else:
+            grid, row0 = by_id(uc["start"]["sheetId"])["grid"], uc["start"]["rowIndex"]
+            for i, r in enumerate(uc.get("rows", [])):
+                while len(grid) <= row0 + i: grid.append([])
+                grid[row0 + i] = [cell_value(c) for c in r.get("values", [])]
+    return {}
+
+def a1_rows(rng: str) -> tuple[str, int, int | None]:
+    """'OJD'!A2:E3 -> ("OJD", 2, 3); sin fila final -> None."""
+    title, _, cells = unquote(rng).rpartition("!")
+    nums = [int(n) for n in re.findall(r"[A-Z]+(\d+)", cells)]
+    return title.strip("'"), (nums[0] if nums else 1), (nums[1] if len(nums) > 1 else None)
+
+# ========================== SERVIDOR ==========================
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    def log_message(self, *a): pass
+
+    def _send(self, code: int, body: str = "", ctype: str = "text/html; charset=utf-8", headers=()):
+        data = body.encode("utf-8")
+        self.send_response(code)
+        for k, v in headers: self.send_header(k, v)
+        self.send_header("Content-Type", ctype); self.send_header("Content-Length", str(len(data)))
+        self.end_headers(); self.wfile.write(data)
+
+    def _json(self, obj, code: int = 200):
+        self._send(code, json_dumps(obj), "application/json")
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _logged_in(self) -> bool:
+        m = re.search(r"OJDSESSID=(\w+)", self.headers.get("Cookie") or "")
+        return bool(m) and m.group(1) in SESSIONS
+
+    def do_GET(self):
+        u = urlparse(self.path)
+        if u.path == "/_stats": return self._json(dict(STATS))
+        if u.path.startswith("/v4/spreadsheets/"): return self.sheets("GET", u)
+        time.sleep(MOCK_LATENCY_MS / 1000)
+        if u.path == LOGIN_PATH:
+            hit("ojd_login_page")
+            token = secrets.token_hex(8)
+            with _lock: CSRF.add(token)
+            return self._send(200, LOGIN_HTML.format(action=LOGIN_PATH, csrf=token))
+        if u.path == TM_PATH:
+            if not self._logged_in():
+                hit("ojd_redirect_login")
+                return self._send(302, headers=[("Location", LOGIN_PATH)])
+            fecha = parse_qs(u.query).get("fecha", [default_dmy()])[0]
+            hit("ojd_search" if u.query else "ojd_tm_page")
+            return self._send(200, tm_page(fecha))
+        hit("ojd_404"); self._send(404, "not found")
+
+    def do_POST(self):
+        u = urlparse(self.path)
+        if u.path == "/_reset":
+            with _lock: STATS.clear()
+            return self._json({})
+        if u.path.startswith("/v4/spreadsheets/"): return self.sheets("POST", u)
+        time.sleep(MOCK_LATENCY_MS / 1000)
+        if u.path == LOGIN_PATH:
+            hit("ojd_login_post")
+            form = {k: v[0] for k, v in parse_qs(self._body().decode("utf-8")).items()}
+            with _lock: csrf_ok = form.get("_csrf") in CSRF
+            if csrf_ok and form.get("_username") == MOCK_USER and form.get("_password") == MOCK_PASS:
+                sid = secrets.token_hex(16)
+                with _lock: SESSIONS.add(sid)
+                return self._send(302, headers=[("Location", TM_PATH),
+                                                ("Set-Cookie", f"OJDSESSID={sid}; Path=/; HttpOnly")])
+            return self._send(200, LOGIN_HTML.format(action=LOGIN_PATH, csrf=secrets.token_hex(8)))
+        hit("ojd_404"); self._send(404, "not found")
+
+    def sheets(self, method: str, u):
+        time.sleep(MOCK_SHEETS_LATENCY_MS / 1000)
+        rest = u.path[len("/v4/spreadsheets/"):]
+        sid, _, tail = rest.partition("/")
+        with _lock:
+            if not SHEETS: add_sheet("Hoja 1")
+            if method == "POST" and sid.endswith(":batchUpdate"):
+                STATS["sheets_batchUpdate"] += 1
+                reqs = json_loads(self._body() or b"{}").get("requests", [])
+                STATS["sheets_requests"] += len(reqs)
+                return self._json({"spreadsheetId": sid.split(":")[0], "replies": [apply_request(r) for r in reqs]})
+            if method == "GET" and not tail:
+                STATS["sheets_metadata"] += 1
+                return self._json({"spreadsheetId": sid, "properties": {"title": "OJD (mock)", "locale": "es_ES"},
+                                   "sheets": [{"properties": sheet_props(t)} for t in SHEETS]})
+            if method == "GET" and tail.startswith("values/"):
+                STATS["sheets_values_get"] += 1
+                title, r0, r1 = a1_rows(tail[len("values/"):])
+                grid = SHEETS.get(title, {"grid": []})["grid"]
+                values = grid[r0 - 1:r1] if r1 else grid[r0 - 1:]
+                while values and not any(v != "" for v in values[-1]): values = values[:-1]
+                return self._json({"range": unquote(tail[7:]), "majorDimension": "ROWS", "values": values})
+            STATS["sheets_other"] += 1
+        self._json({"error": {"code": 400, "message": f"mock: {method} {u.path} no soportado"}}, 400)
+
+def serve(port: int = MOCK_PORT) -> ThreadingHTTPServer:
+    srv = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+# ========================== E2E ==========================
+def e2e_modes() -> list[tuple[str, dict]]:
+    modes = []
+    for part in filter(None, (p.strip() for p in MOCK_E2E_MODES.split(";"))):
+        name, _, assigns = part.partition("=")
+        modes.append((name, dict(a.split("=", 1) for a in assigns.split(",") if "=" in a)))
+    return modes
+
+def run_e2e(base: str) -> int:
+    """ojd_export.py en un directorio temporal por modo: latencia total, peticiones al portal y a Sheets."""
+    script = pathlib.Path(__file__).resolve().parent.parent / "ojd_export.py"
+    end = datetime.now() - timedelta(days=2)
+    rng = MOCK_E2E_RANGE or f"{end - timedelta(days=6):%d/%m/%Y}-{end:%d/%m/%Y}"
+    failed = 0
+    print(f"[E2E] Rango {rng}; latencia portal {MOCK_LATENCY_MS} ms, Sheets {MOCK_SHEETS_LATENCY_MS} ms")
+    for name, extra in e2e_modes():
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {**os.environ, "OJD_BASE_URL": base, "SHEETS_API_URL": base,
+                   "OJD_USER": MOCK_USER, "OJD_PASS": MOCK_PASS, "BACKFILL_RANGE": rng,
+                   "HISTORY_DB": "", "SESSION_CACHE_KEY": "", **extra}
+            with _lock: STATS.clear(); SHEETS.clear()
+            t0 = time.perf_counter()
+            proc = subprocess.run([sys.executable, str(script)], cwd=tmp, env=env, capture_output=True, text=True)
+            wall = time.perf_counter() - t0
+            reports = sorted(pathlib.Path(tmp, "debug").glob("run_report_*.json"))
+            report = json_loads(reports[-1].read_text(encoding="utf-8")) if reports else {}
+        with _lock: stats = dict(STATS)
+        ojd = {k[4:]: v for k, v in stats.items() if k.startswith("ojd_")}
+        sheets = {k[7:]: v for k, v in stats.items() if k.startswith("sheets_")}
+        status = "ok" if proc.returncode == 0 else f"rc={proc.returncode}"
+        print(f"[E2E] {name:<10} {wall:7.2f} s  {status:<6} portal {sum(ojd.values()):>3} {ojd}  "
+              f"Sheets {sheets}  etapas {report.get('stages', {})}")
+        if proc.returncode:
+            failed += 1
+            print("\n".join("    " + l for l in (proc.stdout + proc.stderr).strip().splitlines()[-5:]))
+    return 1 if failed else 0
+
+def main() -> int:
+    srv = serve()
+    base = f"http://127.0.0.1:{srv.server_address[1]}"
+    if sys.argv[1:] == ["e2e"]:
+        try: return run_e2e(base)
+        finally: srv.shutdown()
+    print(f"[MOCK] Portal y Sheets en {base} (Ctrl+C para parar; contadores en {base}/_stats)")
+    print(f"[MOCK] export OJD_BASE_URL={base} SHEETS_API_URL={base} OJD_USER={MOCK_USER} OJD_PASS={MOCK_PASS}")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"[MOCK] Peticiones: {dict(STATS)}")
+    finally:
+        srv.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
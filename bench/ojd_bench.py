@@ -0,0 +1,240 @@
+"""
+Benchmark offline del parser de ojd_export.py (sin credenciales ni red).
+
+Corpus: las páginas grabadas de bench/pages/*.html y una versión sintética grande de
+cada una (BENCH_ROWS filas, replicando sus filas con nombres y cifras variados).
+Etapas: read_table (solo si Chromium está instalado), table_from_html, pick_table,
+shape_output, shape_rows (modo LEAN), canonical_name, to_int y _to_serial_rows. Con
+Chromium, además, read_cells_all_pages sobre bench/pages/paged debe leer todas las filas.
+
+Sin Chromium, read_table no se mide: la baseline debe guardarse en una máquina con
+Chromium (BENCH_SAVE se niega sin él salvo BENCH_BROWSER=0) y una etapa medida que falte
+en la baseline hace fallar la comparación.
+
+Por etapa se mide la mediana de BENCH_REPEAT repeticiones (filas/s) y el pico de memoria
+(tracemalloc). Cada tiempo se normaliza con una computación de referencia en Python puro
+medida en la misma ejecución, así la baseline (bench/baseline.json) vale entre máquinas y
+con la CPU cargada. Sale con código 1 si alguna etapa normalizada es más lenta que
+baseline × BENCH_TOLERANCE, umbral que se ensancha con la dispersión de las repeticiones.
+
+  python bench/ojd_bench.py                    # medir y comparar con la baseline
+  BENCH_SAVE=1 python bench/ojd_bench.py       # medir y guardar como nueva baseline
+"""
+import os, sys, time, pathlib, statistics, tracemalloc
+from io import StringIO
+from datetime import datetime
+from json import loads as json_loads, dumps as json_dumps
+
+BENCH_DIR = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+os.environ.setdefault("HISTORY_DB", "")
+import pandas as pd
+import ojd_export as ojd
+from corpus import PAGES_DIR, recorded_pages, synth_rows
+
+# ========================== CONFIG ==========================
+BENCH_ROWS = int(os.getenv("BENCH_ROWS", "5000"))          # filas del corpus sintético grande
+BENCH_REPEAT = max(3, int(os.getenv("BENCH_REPEAT", "9")))
+BENCH_MIN_MS = float(os.getenv("BENCH_MIN_MS", "50"))   # duración mínima de cada repetición
+BENCH_TOLERANCE = float(os.getenv("BENCH_TOLERANCE", "1.5"))
+BENCH_SAVE = os.getenv("BENCH_SAVE", "").strip().lower() in {"1","true","yes","si","sí"}
+BENCH_BROWSER = os.getenv("BENCH_BROWSER", "1").strip().lower() not in {"0","false","no"}
+BASELINE = pathlib.Path(os.getenv("BENCH_BASELINE", BENCH_DIR / "baseline.json"))
+DATA_DATE = datetime(2026, 10, 14)
+
+# ========================== CORPUS ==========================
+def load_corpus() -> dict[str, str]:
+    corpus = {}
+    for name, html in recorded_pages().items():
+        corpus[name] = html
+        corpus[f"{name}_x{BENCH_ROWS}"] = synth_rows(html, BENCH_ROWS)
+    return corpus
+
+# ========================== MEDICIÓN ==========================
+def _timed(fn, setup, loops: int) -> float:
+    """Segundos por llamada de `loops` llamadas seguidas (setup fuera del tiempo medido)."""
+    total = 0.0
+    for _ in range(loops):
+        if setup: setup()
+        t0 = time.perf_counter(); fn(); total += time.perf_counter() - t0
+    return total / loops
+
+def measure(fn, setup=None) -> tuple[float, float, int]:
+    """
+    (mediana del tiempo por llamada en s de BENCH_REPEAT repeticiones, dispersión relativa
+    (rango intercuartílico / mediana), pico de memoria en bytes de una pasada). Como timeit,
+    cada repetición agrupa llamadas hasta BENCH_MIN_MS para que las etapas de microsegundos
+    no dependan del ruido del reloj.
+    """
+    loops = 1
+    while _timed(fn, setup, loops) * loops < BENCH_MIN_MS / 1000 and loops < 100_000:
+        loops *= 10
+    times = [_timed(fn, setup, loops) for _ in range(BENCH_REPEAT)]
+    q1, med, q3 = statistics.quantiles(times, n=4)
+    if setup: setup()
+    tracemalloc.start()
+    try:
+        fn(); peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return med, (q3 - q1) / med, peak
+
+def _reference_work():
+    """Mezcla fija de str/dict/sort/int sin código del exportador: la vara de medir de la máquina."""
+    words = [f"{(i * 7919) % 10007:05d}.{i % 97}" for i in range(5000)]
+    index = {w.lower().replace(".", ""): i for i, w in enumerate(words)}
+    return sum(int(k) for k in sorted(index)) + len(index)
+
+def reference() -> dict:
+    secs, spread, _ = measure(_reference_work)
+    return {"seconds": secs, "spread": spread}
+
+def browser_reader():
+    """read_table sobre Chromium real (page.set_content); None si Playwright/Chromium no está."""
+    if not BENCH_BROWSER: return None
+    try:
+        from playwright.sync_api import sync_playwright
+        pw = sync_playwright().start()
+        browser = pw.chromium.launch(headless=True)
+    except Exception as e:
+        print(f"[BENCH][WARN] Sin Chromium ({type(e).__name__}): se omite read_table.")
+        return None
+    page = browser.new_page()
+    def read(html):
+        page.set_content(html, wait_until="domcontentloaded")
+        return lambda: ojd.read_table(page)
+    read.page = page
+    read.close = lambda: (browser.close(), pw.stop())
+    return read
+
+def check_pagination(reader) -> tuple[dict, list[str]]:
+    """
+    read_cells_all_pages sobre las páginas de bench/pages/paged (listado paginado en el
+    cliente, tabla de datos que no es la primera): tiempo y fallo si no se leen todas las filas.
+    """
+    results, errors = {}, []
+    for p in sorted((PAGES_DIR / "paged").glob("*.html")):
+        page = reader.page
+        page.set_content(p.read_text(encoding="utf-8"), wait_until="domcontentloaded")
+        total = int(page.get_attribute("table[data-total]", "data-total"))
+        t0 = time.perf_counter(); cells = ojd.read_cells_all_pages(page); secs = time.perf_counter() - t0
+        results[p.stem] = {"read_table_all_pages": {"seconds": secs, "items": len(cells.rows),
+                                                    "per_sec": len(cells.rows) / secs, "peak_kib": 0}}
+        if len(cells.rows) != total:
+            errors.append(f"{p.stem}: paginación leyó {len(cells.rows)} de {total} filas")
+    return results, errors
+
+def bench_page(html: str, reader) -> dict:
+    results = {}
+    def run(stage, items, fn, setup=None):
+        secs, spread, peak = measure(fn, setup)
+        results[stage] = {"seconds": secs, "spread": spread, "items": items,
+                          "per_sec": items / secs if secs else None, "peak_kib": peak // 1024}
+
+    tables = pd.read_html(StringIO(html))
+    df = ojd.pick_table(tables)
+    media_col = ojd.media_column(df)
+    rows = len(df)
+    names = df[media_col].astype(str).tolist()
+    raw = [v for c in ojd.metric_columns(df) if c for v in df[c].tolist()]
+    serial_in = ojd.shape_all(df, media_col, DATA_DATE).astype(object).values.tolist()
+
+    if reader: run("read_table", rows, reader(html))
+    run("table_from_html", rows, lambda: ojd.table_from_html(html))
+    run("pick_table", len(tables), lambda: ojd.pick_table(tables))
+    run("shape_output", rows, lambda: ojd.shape_output(df, media_col, DATA_DATE),
+        setup=ojd.canonical_name.cache_clear)
+    cells = ojd.cells_from_html(html)
+    run("shape_rows", rows, lambda: ojd.shape_rows(cells, DATA_DATE), setup=ojd.canonical_name.cache_clear)
+    run("canonical_name", len(names), lambda: [ojd.canonical_name(n) for n in names],
+        setup=ojd.canonical_name.cache_clear)
+    run("to_int", len(raw), lambda: [ojd.to_int(v) for v in raw])
+    run("_to_serial_rows", len(serial_in), lambda: ojd._to_serial_rows(serial_in))
+    return results
+
+# ========================== INFORME ==========================
+def ratio(r: dict, base: dict, ref: dict, base_ref: dict) -> float:
+    """Tiempo de la etapa relativo a la baseline, descontando la velocidad de cada máquina/ejecución."""
+    return (r["seconds"] / ref["seconds"]) / (base["seconds"] / base_ref["seconds"])
+
+def compare(results: dict, baseline: dict) -> list[str]:
+    """
+    Etapas más lentas que la baseline. Umbral: BENCH_TOLERANCE más dos veces la dispersión
+    de la etapa y de la referencia (la mayor de ahora y de la baseline); las etapas de una
+    sola pasada (sin "spread", p. ej. la paginación en Chromium) no entran en la puerta.
+    Una etapa medida sin entrada en la baseline también falla: si no, nunca se vigilaría.
+    """
+    ref, base_ref = results.get("_reference"), baseline.get("_reference")
+    if not ref or not base_ref:
+        return ["baseline sin _reference: vuelve a guardarla con BENCH_SAVE=1"]
+    slower = []
+    for corpus, stages in results.items():
+        if corpus == "_reference": continue
+        for stage, r in stages.items():
+            if "spread" not in r: continue
+            base = baseline.get(corpus, {}).get(stage)
+            if not base or "spread" not in base:
+                slower.append(f"{corpus}/{stage}: sin baseline (BENCH_SAVE=1 para registrarla)")
+                continue
+            noise = 2 * (max(r["spread"], base["spread"]) + max(ref["spread"], base_ref["spread"]))
+            x = ratio(r, base, ref, base_ref)
+            if x > BENCH_TOLERANCE + noise:
+                slower.append(f"{corpus}/{stage}: {r['seconds']*1e3:.2f} ms "
+                              f"(baseline {base['seconds']*1e3:.2f} ms, ×{x:.2f} normalizado, "
+                              f"umbral ×{BENCH_TOLERANCE + noise:.2f})")
+    return slower
+
+def unmeasured(results: dict, baseline: dict) -> list[str]:
+    """Etapas de la baseline que esta ejecución no midió (p. ej. read_table sin Chromium)."""
+    return [f"{corpus}/{stage}" for corpus, stages in baseline.items() if corpus != "_reference"
+            for stage, b in stages.items() if "spread" in b and stage not in results.get(corpus, {})]
+
+def main() -> int:
+    corpus = load_corpus()
+    if not corpus:
+        print(f"[BENCH][ERR] No hay páginas en {PAGES_DIR}"); return 2
+    reader = browser_reader()
+    results, errors = {"_reference": reference()}, []
+    try:
+        for name, html in corpus.items():
+            results[name] = bench_page(html, reader)
+        if reader:
+            paged, errors = check_pagination(reader)
+            results.update(paged)
+    finally:
+        if reader: reader.close()
+
+    baseline = json_loads(BASELINE.read_text(encoding="utf-8")) if BASELINE.exists() else {}
+    ref, base_ref = results["_reference"], baseline.get("_reference")
+    print(f"[BENCH] referencia {ref['seconds']*1e3:.2f} ms"
+          + (f"  (baseline {base_ref['seconds']*1e3:.2f} ms)" if base_ref else ""))
+    for name, stages in results.items():
+        if name == "_reference": continue
+        print(f"[BENCH] {name}")
+        for stage, r in stages.items():
+            base = baseline.get(name, {}).get(stage)
+            x = f"  ×{ratio(r, base, ref, base_ref):.2f} vs baseline" if base and base_ref else ""
+            print(f"    {stage:<16} {r['seconds']*1e3:9.2f} ms  {r['per_sec'] or 0:>12,.0f} items/s"
+                  f"  pico {r['peak_kib']:>7,} KiB{x}")
+
+    for e in errors: print(f"[BENCH][FAIL] {e}")
+    if errors: return 1
+    if BENCH_SAVE:
+        if BENCH_BROWSER and not reader:
+            print("[BENCH][ERR] Sin Chromium no se guarda la baseline: read_table quedaría fuera de la "
+                  "puerta. Instala Chromium (playwright install chromium) o BENCH_BROWSER=0 para forzarlo.")
+            return 2
+        BASELINE.write_text(json_dumps(results, indent=1), encoding="utf-8")
+        print(f"[BENCH] Baseline guardada en {BASELINE}")
+        return 0
+    if not baseline:
+        print("[BENCH] Sin baseline: BENCH_SAVE=1 para guardar esta medición como referencia.")
+        return 0
+    for s in unmeasured(results, baseline): print(f"[BENCH][WARN] {s}: en la baseline pero no medida")
+    slower = compare(results, baseline)
+    for s in slower: print(f"[BENCH][FAIL] {s}")
+    print("[BENCH] OK" if not slower else f"[BENCH] {len(slower)} etapas más lentas que la baseline o sin baseline.")
+    return 1 if slower else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,42 +1,146 @@
-import os, re, time, pathlib, hashlib
-from json import loads as json_loads
+from __future__ import annotations
+
+import os, re, time, pathlib, hashlib, queue, threading, asyncio, base64, numbers, csv, sqlite3, importlib
+from collections import Counter
+from contextlib import contextmanager, nullcontext, closing
+from dataclasses import dataclass
+from functools import lru_cache
+from json import loads as json_loads, dumps as json_dumps
+from urllib.parse import urlparse
 from datetime import datetime, date, timedelta
 from zoneinfo import ZoneInfo
 
-import pandas as pd
+import requests, lxml.html
+from requests.adapters import HTTPAdapter
 from unidecode import unidecode
 from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
+from playwright.async_api import async_playwright
+from cryptography.fernet import Fernet, InvalidToken
 
 # ========================== CONFIG ==========================
 SHEET_ID  = "1ra1VSpOZ6JuMp-S_MsqNbHEGr2n0VA702lbFsVBD-Os"  # Hoja base
 SHEET_TAB = os.getenv("SHEET_TAB", "OJD")
+# Modo "todos los medios": además de la salida filtrada, toda la tabla en otra pestaña
+ALL_MEDIA = os.getenv("ALL_MEDIA", "").strip().lower() in {"1","true","yes","si","sí"}
+SHEET_TAB_ALL = os.getenv("SHEET_TAB_ALL", f"{SHEET_TAB}_TODOS")
+
+# OJD_BASE_URL / SHEETS_API_URL apuntan a un portal y una API de Sheets locales (bench/mock_ojd.py)
+OJD_BASE_URL = os.getenv("OJD_BASE_URL", "https://www.ojdinteractiva.es").strip().rstrip("/")
+SHEETS_API_URL = os.getenv("SHEETS_API_URL", "").strip().rstrip("/")
+LOGIN_URL = f"{OJD_BASE_URL}/traffic-monitoring/login"
+TM_URL    = f"{OJD_BASE_URL}/traffic-monitoring/traffic-monitoring/0/"
 
-LOGIN_URL = "https://www.ojdinteractiva.es/traffic-monitoring/login"
-TM_URL    = "https://www.ojdinteractiva.es/traffic-monitoring/traffic-monitoring/0/"
+# Esperas dirigidas por eventos (ms): respuesta de datos tras Buscar y cambio de la tabla
+READY_TIMEOUT_MS = int(os.getenv("READY_TIMEOUT_MS", "15000"))
+TABLE_SETTLE_MS  = int(os.getenv("TABLE_SETTLE_MS", "1500"))
+# Paginación de la tabla: se pide el mayor tamaño de página y se recorren como mucho MAX_PAGES
+PAGINATE  = os.getenv("PAGINATE", "1").strip().lower() not in {"0","false","no"}
+MAX_PAGES = int(os.getenv("MAX_PAGES", "50"))
 
-OJD_USER = os.environ["OJD_USER"]
-OJD_PASS = os.environ["OJD_PASS"]
+OJD_USER = os.getenv("OJD_USER", "")
+OJD_PASS = os.getenv("OJD_PASS", "")
 
 # Opcional: forzar fecha (dd/mm/yyyy), útil para pruebas o re-procesos
 FORCE_DATE_STR = os.getenv("FORCE_DATE_DDMMYYYY", "").strip()
+# Opcional: backfill de un rango "dd/mm/yyyy-dd/mm/yyyy" (un login, una escritura)
+BACKFILL_RANGE = os.getenv("BACKFILL_RANGE", "").strip()
+# Nº de contextos de navegador en paralelo para el backfill (comparten la sesión). Con el
+# motor sync cada uno es un hilo con su propio proceso Chromium (~150 MB de RAM): se limita
+# a BACKFILL_MAX_BROWSERS. El motor async abre páginas de un solo navegador y no lo necesita.
+BACKFILL_WORKERS = max(1, int(os.getenv("BACKFILL_WORKERS", "1") or 1))
+BACKFILL_MAX_BROWSERS = max(1, int(os.getenv("BACKFILL_MAX_BROWSERS", "4") or 4))
+# Motor de Playwright: "sync" (por defecto) o "async" (varias páginas en un solo event loop)
+OJD_ENGINE = os.getenv("OJD_ENGINE", "sync").strip().lower()
+# Backend: "browser" (Playwright, por defecto) o "http" (sin navegador; Playwright como respaldo)
+OJD_BACKEND = os.getenv("OJD_BACKEND", "browser").strip().lower()
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+# Bloqueo de recursos: solo se dejan pasar estos tipos y hosts (BLOCK_RESOURCES=0 lo desactiva)
+BLOCK_RESOURCES = os.getenv("BLOCK_RESOURCES", "1").strip().lower() not in {"0","false","no"}
+ALLOW_RESOURCE_TYPES = {t.strip() for t in os.getenv(
+    "ALLOW_RESOURCE_TYPES", "document,script,xhr,fetch,other").split(",") if t.strip()}
+ALLOW_HOSTS = {h.strip() for h in os.getenv(
+    "ALLOW_HOSTS", "ojdinteractiva.es,code.jquery.com,cdnjs.cloudflare.com,cdn.jsdelivr.net,"
+                   "ajax.googleapis.com,unpkg.com").split(",") if h.strip()} | {urlparse(OJD_BASE_URL).hostname}
+# Leer los datos del JSON/XHR que rellena la tabla (con HTML como respaldo, también si el feed
+# es paginado en el servidor y trae menos filas de las que declara)
+CAPTURE_FEED = os.getenv("CAPTURE_FEED", "").strip().lower() in {"1","true","yes","si","sí"}
+# Ruta ligera (filas como listas, sin pandas) para la ejecución de una sola fecha; backfill,
+# async, ALL_MEDIA y CAPTURE_FEED siguen con DataFrames. LEAN=0 fuerza siempre pandas.
+LEAN = (os.getenv("LEAN", "1").strip().lower() not in {"0","false","no"}
+        and not (BACKFILL_RANGE or OJD_ENGINE == "async" or ALL_MEDIA or CAPTURE_FEED))
+# Salida alternativa a Sheets: DRY_RUN=1 solo imprime; OUTPUT_CSV=ruta escribe un CSV local
+DRY_RUN = os.getenv("DRY_RUN", "").strip().lower() in {"1","true","yes","si","sí"}
+OUTPUT_CSV = os.getenv("OUTPUT_CSV", "").strip()
+# Escritura en la hoja: "replace" (borra y reescribe, por defecto) o "upsert" por (Fecha, Nombre)
+WRITE_MODE = os.getenv("WRITE_MODE", "replace").strip().lower()
+# Índice local clave -> fila para el modo upsert (evita releer la hoja en cada ejecución)
+SHEET_INDEX_CACHE = pathlib.Path(os.getenv("SHEET_INDEX_CACHE", ".ojd_sheet_index.json"))
+# Histórico local (SQLite) de cada día publicado; HISTORY_DB="" lo desactiva
+HISTORY_DB = os.getenv("HISTORY_DB", "ojd_history.sqlite").strip()
+# Estado local entre ejecuciones (hash de lo publicado por fecha); FORCE_WRITE=1 ignora el hash
+STATE_FILE = pathlib.Path(os.getenv("STATE_FILE", ".ojd_state.json"))
+FORCE_WRITE = os.getenv("FORCE_WRITE", "").strip().lower() in {"1","true","yes","si","sí"}
+
+# Caché cifrada de la sesión (storage_state) para evitar el login en cada ejecución.
+# Clave: SESSION_CACHE_KEY (Fernet) o, si falta, derivada de las credenciales OJD.
+SESSION_CACHE = pathlib.Path(os.getenv("SESSION_CACHE", ".ojd_session.bin"))
+SESSION_CACHE_KEY = os.getenv("SESSION_CACHE_KEY", "").strip()
 
 # ========================== GOOGLE SHEETS ==========================
 import gspread
 from google.oauth2.service_account import Credentials
-from gspread_formatting import CellFormat, numberFormat, format_cell_range
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets",
           "https://www.googleapis.com/auth/drive"]
-creds_json = json_loads(os.environ["GOOGLE_SERVICE_ACCOUNT_JSON"])
-creds = Credentials.from_service_account_info(creds_json, scopes=SCOPES)
-gc = gspread.authorize(creds)
-sh = gc.open_by_key(SHEET_ID)
-try:
-    ws = sh.worksheet(SHEET_TAB)
-except gspread.exceptions.WorksheetNotFound:
-    ws = sh.add_worksheet(title=SHEET_TAB, rows=2000, cols=10)
+_sh = None
+_ws_cache = {}
+_ws_lock = threading.Lock()
+
+class _SheetsApiSession(requests.Session):
+    """Sesión sin credenciales que envía las llamadas de gspread a SHEETS_API_URL."""
+    def request(self, method, url, *args, **kwargs):
+        url = url.replace("https://sheets.googleapis.com", SHEETS_API_URL, 1)
+        return super().request(method, url, *args, **kwargs)
+
+def get_ws(tab: str = SHEET_TAB):
+    """Pestaña destino; se autoriza y abre la primera vez que se pide y queda cacheada."""
+    global _sh
+    with _ws_lock:
+        if _sh is None and SHEETS_API_URL:
+            _sh = gspread.Client(None, session=_SheetsApiSession()).open_by_key(SHEET_ID)
+        elif _sh is None:
+            creds_json = json_loads(os.environ["GOOGLE_SERVICE_ACCOUNT_JSON"])
+            creds = Credentials.from_service_account_info(creds_json, scopes=SCOPES)
+            _sh = gspread.authorize(creds).open_by_key(SHEET_ID)
+        if tab not in _ws_cache:
+            try:
+                _ws_cache[tab] = _sh.worksheet(tab)
+            except gspread.exceptions.WorksheetNotFound:
+                _ws_cache[tab] = _sh.add_worksheet(title=tab, rows=2000, cols=10)
+        return _ws_cache[tab]
+
+def sheets_enabled() -> bool:
+    return not (DRY_RUN or OUTPUT_CSV)
+
+def prefetch_ws():
+    """Autoriza Sheets en segundo plano, solapado con el lanzamiento de Chromium."""
+    if not sheets_enabled(): return
+    def _bg():
+        try: get_ws()
+        except Exception as e: print(f"[SHEETS][WARN] Prefetch fallido (se reintenta al escribir): {e}")
+    threading.Thread(target=_bg, daemon=True).start()
 
 # ========================== UTILS ==========================
+class _LazyModule:
+    """Módulo que se importa en el primer acceso a un atributo (pandas solo si se usa)."""
+    def __init__(self, name: str):
+        self._name, self._mod = name, None
+    def __getattr__(self, attr):
+        if self._mod is None: self._mod = importlib.import_module(self._name)
+        return getattr(self._mod, attr)
+
+pd = _LazyModule("pandas")
+
 DEBUG_DIR = pathlib.Path("debug"); DEBUG_DIR.mkdir(exist_ok=True)
 
 def tz_now() -> datetime:
@@ -58,6 +162,14 @@ def parse_dmy(s: str) -> datetime | None:
     except Exception:
         return None
 
+def parse_range(s: str) -> list[datetime]:
+    """'dd/mm/yyyy-dd/mm/yyyy' -> lista de fechas (ambos extremos incluidos)."""
+    a, _, b = s.partition("-")
+    d0, d1 = parse_dmy(a), parse_dmy(b or a)
+    if not d0 or not d1: return []
+    if d1 < d0: d0, d1 = d1, d0
+    return [d0 + timedelta(days=i) for i in range((d1 - d0).days + 1)]
+
 def gs_date_serial(d: date) -> int:
     # Serial de Google Sheets (sistema 1899-12-30)
     return (d - date(1899, 12, 30)).days
@@ -65,113 +177,153 @@ def gs_date_serial(d: date) -> int:
 def norm(s: str) -> str:
     return re.sub(r"[^a-z0-9]", "", unidecode(str(s).lower()))
 
-TARGET_NAMES = {
-    "ultimahora":            "ULTIMAHORA.ES",
-    "diariodemallorca":      "DIARIODEMALLORCA.ES",
-    "diariodeibiza":         "DIARIODEIBIZA.ES",
-    "mallorcamagazin":       "MALLORCAMAGAZIN.COM",
-    "mallorcazeitung":       "MALLORCAZEITUNG.COM",
-    "majorcadaily":          "MAJORCADAILYBULLETIN.COM",
-    "majorcadailybulletin":  "MAJORCADAILYBULLETIN.COM",
-    "periodicodeibiza":      "PERIODICODEIBIZA.ES",
-    "lavozdeibiza":          "LAVOZDEIBIZA.COM",
-}
+# Catálogo de medios (en el orden de salida): [{"name": ..., "aliases": [...]}, ...]
+MEDIA_CATALOGUE = pathlib.Path(os.getenv("MEDIA_CATALOGUE", pathlib.Path(__file__).with_name("media.json")))
 
-ALIASES = {
-    "ultimahora": {
-        "ultimahora.es","ultimahora","ultima hora","última hora"
-    },
-    "diariodemallorca": {
-        "diariodemallorca.es","diariodemallorca","diario de mallorca"
-    },
-    "diariodeibiza": {
-        "diariodeibiza.es","diariodeibiza","diario de ibiza"
-    },
-    "mallorcamagazin": {
-        "mallorcamagazin.es","mallorca magazin","mallorcamagazin.com"
-    },
-    "mallorcazeitung": {
-        "mallorcazeitung.es","mallorca zeitung","mallorcazeitung.com"
-    },
-    "majorcadaily": {
-        "majorcadailybulletin.es","majorcadaily","majorca daily bulletin",
-        "majorca daily","majorcadailybulletin.com"
-    },
-    "majorcadailybulletin": {
-        "majorcadailybulletin.es","majorcadailybulletin.com","majorca daily bulletin"
-    },
-    "periodicodeibiza": {
-        "periodicodeibiza.es","periodico de ibiza","periódico de ibiza","periodicodeibiza"
-    },
-    "lavozdeibiza": {
-        "lavozdeibiza.com","la voz de ibiza","voz de ibiza","lavozdeibiza"
-    },
-}
+def load_catalogue(path: pathlib.Path) -> list[dict]:
+    """Lee y valida el catálogo: nombre único, al menos un alias y sin alias compartidos."""
+    media = json_loads(pathlib.Path(path).read_text(encoding="utf-8"))
+    names = set()
+    for m in media:
+        if not isinstance(m.get("name"), str) or not m.get("aliases"):
+            raise ValueError(f"Entrada de catálogo no válida: {m!r}")
+        if m["name"] in names:
+            raise ValueError(f"Medio duplicado en el catálogo: {m['name']}")
+        names.add(m["name"])
+    for w in alias_overlaps(media): print(f"[CATALOGUE][WARN] {w}")
+    return media
 
-# Orden deseado (periodicodeibiza penúltimo, lavozdeibiza último)
-ORDER_KEYS = [
-    "ultimahora",
-    "diariodemallorca",
-    "diariodeibiza",
-    "mallorcamagazin",
-    "mallorcazeitung",
-    "majorcadaily",
-    "periodicodeibiza",  # penúltimo
-    "lavozdeibiza"       # último
-]
+def alias_overlaps(media: list[dict]) -> list[str]:
+    """
+    Alias normalizados iguales en dos medios -> ValueError. Alias de un medio contenido
+    en un alias de otro -> aviso (lo resuelve la coincidencia más larga).
+    """
+    owner = {}
+    for m in media:
+        for a in m["aliases"]:
+            na = norm(a)
+            if owner.setdefault(na, m["name"]) != m["name"]:
+                raise ValueError(f"Alias '{a}' compartido por {owner[na]} y {m['name']}")
+    out = []
+    for na, name in owner.items():
+        for i in range(len(na)):
+            for j in range(i + 1, len(na) + 1):
+                other = owner.get(na[i:j])
+                if other and other != name and (i, j) != (0, len(na)):
+                    out.append(f"'{na[i:j]}' ({other}) está dentro de '{na}' ({name})")
+    return out
+
+def compile_aliases(media: list[dict]):
+    """
+    Alias normalizados una sola vez -> (regex con una alternancia, alias -> nombre).
+    Los alias más largos van primero: en la misma posición gana la coincidencia más larga.
+    """
+    alias_name = {}
+    for m in media:
+        for a in m["aliases"]:
+            na = norm(a)
+            if na: alias_name.setdefault(na, m["name"])
+    pattern = "|".join(re.escape(a) for a in sorted(alias_name, key=len, reverse=True))
+    return re.compile(pattern), alias_name
+
+MEDIA = load_catalogue(MEDIA_CATALOGUE)
+ORDER_INDEX = {m["name"]: i for i, m in enumerate(MEDIA)}
+_ALIAS_RE, _ALIAS_NAME = compile_aliases(MEDIA)
 
+@lru_cache(maxsize=8192)
 def canonical_name(val: str) -> str | None:
     n = norm(val)
-    for key, aliases in ALIASES.items():
-        if any(norm(a) in n for a in aliases):
-            return TARGET_NAMES[key]
-    return None
+    if n in _ALIAS_NAME: return _ALIAS_NAME[n]
+    m = _ALIAS_RE.search(n)
+    return _ALIAS_NAME[m.group(0)] if m else None
 
 def to_int(x):
+    if isinstance(x, numbers.Integral) and not isinstance(x, bool): return int(x)
     s = str(x).strip()
     if s.lower() in {"", "nan", "none", "null"}: return None
     s = s.replace(".", "").replace(",", "")
     return int(s) if s.isdigit() else None
 
+TABLE_SIGNALS = [
+    {"navegadoresunicos","usuariosunicos","usuarios","users","navegadores"},
+    {"visitas","sesiones","sessions","visits"},
+    {"paginasvistas","pageviews","paginas","pv"},
+    {"nombre","medio","site","sitio","dominio","brand","marca","titulo","name"},
+]
+
+# Una alternancia por grupo; las cabeceras normalizadas se unen con "|" (norm no lo produce)
+_SIGNAL_RES = [re.compile("|".join(sorted(g, key=len, reverse=True))) for g in TABLE_SIGNALS]
+
+def table_score(columns) -> int:
+    """Nº de grupos de señales (usuarios, visitas, páginas, nombre) presentes en las columnas."""
+    joined = "|".join(norm(str(c)) for c in columns)
+    return sum(1 for r in _SIGNAL_RES if r.search(joined))
+
 def pick_table(tables):
     # buscamos la tabla con señales típicas
-    signals = [
-        {"navegadoresunicos","usuariosunicos","usuarios","users","navegadores"},
-        {"visitas","sesiones","sessions","visits"},
-        {"paginasvistas","pageviews","paginas","pv"},
-        {"nombre","medio","site","sitio","dominio","brand","marca","titulo","name"},
-    ]
     best, score_best = None, -1
     for t in tables:
-        cols = {norm(c) for c in t.columns}
-        score = sum(any(any(s in col for col in cols) for s in group) for group in signals)
+        score = table_score(t.columns)
         if score > score_best:
             best, score_best = t, score
     return best
 
-def shape_output(df: pd.DataFrame, media_col: str, data_date: datetime) -> pd.DataFrame:
+def metric_columns(df: pd.DataFrame) -> tuple[str | None, str | None, str | None]:
+    """Columnas (navegadores únicos, visitas, páginas vistas) de la tabla, o None si faltan."""
     def find_col(cands):
         for c in df.columns:
             nc = norm(c)
             if any(nc == x or x in nc for x in cands): return c
         return None
-    navu_col    = find_col({"navegadoresunicos","usuariosunicos","usuarios","users"})
-    visitas_col = find_col({"visitas","sesiones","sessions","visits"})
-    pv_col      = find_col({"paginasvistas","pageviews","paginas","pv"})
+    return (find_col({"navegadoresunicos","usuariosunicos","usuarios","users"}),
+            find_col({"visitas","sesiones","sessions","visits"}),
+            find_col({"paginasvistas","pageviews","paginas","pv"}))
+
+def shape_output(df: pd.DataFrame, media_col: str, data_date: datetime) -> pd.DataFrame:
+    navu_col, visitas_col, pv_col = metric_columns(df)
 
     out = pd.DataFrame()
-    out["Fecha"] = ymd(data_date)
-    out["Nombre"] = df[media_col].map(canonical_name)
-    out["Navegadores Únicos"] = df[navu_col].map(to_int)    if navu_col    else None
-    out["Visitas"]            = df[visitas_col].map(to_int) if visitas_col else None
-    out["Páginas Vistas"]     = df[pv_col].map(to_int)      if pv_col      else None
+    out["Nombre"] = canonical_names(df[media_col])
+    # Fecha después de Nombre: sobre un DataFrame vacío el escalar quedaría NaN
+    out.insert(0, "Fecha", ymd(data_date))
+    out["Navegadores Únicos"] = to_int_series(df[navu_col])    if navu_col    else None
+    out["Visitas"]            = to_int_series(df[visitas_col]) if visitas_col else None
+    out["Páginas Vistas"]     = to_int_series(df[pv_col])      if pv_col      else None
 
     out = out.dropna(subset=["Nombre"]).reset_index(drop=True)
-    order_index = {TARGET_NAMES[k]: i for i,k in enumerate(ORDER_KEYS)}
-    out["__ord"] = out["Nombre"].map(lambda x: order_index.get(x, 999))
-    out = out.sort_values("__ord").drop(columns="__ord")
+    out["__ord"] = out["Nombre"].map(ORDER_INDEX).fillna(999)
+    out = out.sort_values("__ord", kind="stable").drop(columns="__ord")
     return out
 
+def shape_all(df: pd.DataFrame, media_col: str, data_date: datetime) -> pd.DataFrame:
+    """
+    Todas las filas de la tabla (modo ALL_MEDIA): nombre canónico si es un medio del
+    catálogo y, si no, el texto original limpio. Sin llamadas por fila.
+    """
+    navu_col, visitas_col, pv_col = metric_columns(df)
+    raw = df[media_col].astype(str).str.strip()
+    none = pd.Series(pd.NA, index=df.index, dtype="Int64")
+    out = pd.DataFrame({
+        "Fecha": ymd(data_date),
+        "Nombre": canonical_names(raw).fillna(raw),
+        "Navegadores Únicos": to_int_series(df[navu_col])    if navu_col    else none,
+        "Visitas":            to_int_series(df[visitas_col]) if visitas_col else none,
+        "Páginas Vistas":     to_int_series(df[pv_col])      if pv_col      else none,
+    }, index=df.index)
+    return out[~raw.str.lower().isin({"", "nan", "none"})].reset_index(drop=True)
+
+def canonical_names(col: pd.Series) -> pd.Series:
+    """canonical_name una vez por valor distinto y difundido a todas las filas."""
+    uniq = col.drop_duplicates()
+    return col.map(dict(zip(uniq, map(canonical_name, uniq))))
+
+def to_int_series(col: pd.Series) -> pd.Series:
+    """Versión vectorizada de to_int (mismas reglas) con resultado Int64 nullable."""
+    if pd.api.types.is_integer_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        return col.astype("Int64")
+    s = col.astype(str).str.strip().str.replace(r"[.,]", "", regex=True)
+    return pd.to_numeric(s.where(s.str.fullmatch(r"\d+")), errors="coerce").astype("Int64")
+
 def _to_serial_rows(rows):
     out = []
     for r in rows:
@@ -186,29 +338,447 @@ def _to_serial_rows(rows):
         out.append(rr)
     return out
 
+# Valores + numberFormat en la misma petición (Fecha, Nombre, 3 métricas)
+FMT_DATE = {"type": "DATE", "pattern": "yyyy-mm-dd"}
+FMT_NUM  = {"type": "NUMBER", "pattern": "#,##0"}
+ROW_FORMATS = [FMT_DATE, None, FMT_NUM, FMT_NUM, FMT_NUM]
+CELL_FIELDS = "userEnteredValue,userEnteredFormat.numberFormat"
+
+def _cell(v, fmt=None) -> dict:
+    cell = {}
+    if isinstance(v, numbers.Number) and not isinstance(v, bool):
+        cell["userEnteredValue"] = {"numberValue": v}
+    elif v not in ("", None):
+        cell["userEnteredValue"] = {"stringValue": str(v)}
+    if fmt: cell["userEnteredFormat"] = {"numberFormat": fmt}
+    return cell
+
+def _update_cells(sheet_id: int, row0: int, rows, header: bool = False) -> dict:
+    """Petición updateCells para `rows` desde la fila `row0` (base 0), columna A."""
+    fmts = [None] * len(HEADER) if header else ROW_FORMATS
+    return {"updateCells": {
+        "start": {"sheetId": sheet_id, "rowIndex": row0, "columnIndex": 0},
+        "rows": [{"values": [_cell(v, f) for v, f in zip(r, fmts)]} for r in rows],
+        "fields": CELL_FIELDS,
+    }}
+
+def _grow_rows(target_ws, needed: int) -> list[dict]:
+    """appendDimension si la rejilla no llega a `needed` filas (va en el mismo batchUpdate)."""
+    if needed <= target_ws.row_count: return []
+    return [{"appendDimension": {"sheetId": target_ws.id, "dimension": "ROWS",
+                                 "length": needed - target_ws.row_count + 500}}]
+
 def _write_ws_with_formats_overwrite(target_ws, values):
-    """Sobrescribe toda la hoja con cabecera+datos y aplica formatos."""
-    target_ws.clear()
-    target_ws.update("A1", values)
-    fmt_date = CellFormat(numberFormat=numberFormat(type="DATE", pattern="yyyy-mm-dd"))
-    fmt_num  = CellFormat(numberFormat=numberFormat(type="NUMBER", pattern="#,##0"))
-    try:
-        format_cell_range(target_ws, "A2:A10000", fmt_date)
-        format_cell_range(target_ws, "C2:E10000", fmt_num)
-    except Exception as e:
-        print(f"[FORMAT][WARN] {e}")
+    """Sobrescribe toda la hoja con cabecera+datos y formatos en un único batchUpdate."""
+    sid = target_ws.id
+    requests_ = _grow_rows(target_ws, len(values)) + [
+        {"updateCells": {"range": {"sheetId": sid}, "fields": CELL_FIELDS}},  # borra valores y formatos
+        _update_cells(sid, 0, values[:1], header=True),
+    ]
+    if values[1:]: requests_.append(_update_cells(sid, 1, values[1:]))
+    target_ws.spreadsheet.batch_update({"requests": requests_})
+
+HEADER = ["Fecha","Nombre","Navegadores Únicos","Visitas","Páginas Vistas"]
+
+NO_DATA = "NO HAY DATOS"
+
+def _serial(v):
+    """Fecha de la hoja (serial o 'YYYY-MM-DD') -> serial entero; si no, el valor tal cual."""
+    if isinstance(v, numbers.Number) and not isinstance(v, bool): return int(v)
+    try: return gs_date_serial(datetime.strptime(str(v), "%Y-%m-%d").date())
+    except ValueError: return v
+
+def _row_key(r) -> str:
+    return f"{_serial(r[0])}|{r[1]}"
+
+def _row_digest(r) -> str:
+    r = (list(r) + [""] * 5)[:5]
+    vals = [_serial(r[0]), str(r[1])] + [int(x) if isinstance(x, numbers.Number) else x for x in r[2:]]
+    return hashlib.md5(json_dumps(vals).encode("utf-8")).hexdigest()
+
+def _sheet_cache_id(tab: str = SHEET_TAB) -> str:
+    return f"{SHEET_ID}/{tab}"
+
+def _state_slot(tab: str = SHEET_TAB) -> str:
+    """Clave del estado local (hashes publicados y ledger): hoja, pestaña y WRITE_MODE."""
+    return f"{_sheet_cache_id(tab)}#{WRITE_MODE}"
+
+def _read_index_cache() -> dict:
+    """{hoja/pestaña: índice} de SHEET_INDEX_CACHE (una entrada por pestaña: OJD y OJD_TODOS)."""
+    try:
+        cached = json_loads(SHEET_INDEX_CACHE.read_text(encoding="utf-8"))
+        return cached if isinstance(cached, dict) and "sheet" not in cached else {}
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _load_sheet_index(target_ws) -> tuple[dict, int]:
+    """
+    ({clave: [fila, digest]}, última fila usada). Se fía de la caché local si la
+    última fila que recuerda sigue igual y la siguiente está vacía (1 lectura
+    pequeña); si no, relee A:E una vez y reconstruye el índice.
+    """
+    try:
+        cached = _read_index_cache().get(_sheet_cache_id(target_ws.title))
+        if cached:
+            last = cached["last"]
+            probe = target_ws.get(f"A{last}:E{last + 1}", value_render_option="UNFORMATTED_VALUE")
+            if len(probe) == 1 and (last == 1 or _row_digest(probe[0]) == cached["last_digest"]):
+                return cached["index"], last
+    except (KeyError, TypeError):
+        pass
+    values = target_ws.get("A1:E", value_render_option="UNFORMATTED_VALUE")
+    index = {_row_key(r): [i, _row_digest(r)]
+             for i, r in enumerate(values[1:], start=2) if len(r) >= 2}
+    return index, max(len(values), 1)
+
+def _save_sheet_index(target_ws, index: dict, last: int):
+    last_digest = next((d for pos, d in index.values() if pos == last), "")
+    cache = _read_index_cache()
+    cache[_sheet_cache_id(target_ws.title)] = {"index": index, "last": last, "last_digest": last_digest}
+    try:
+        SHEET_INDEX_CACHE.write_text(json_dumps(cache), encoding="utf-8")
+    except OSError as e:
+        print(f"[SHEETS][WARN] No se pudo guardar el índice: {e}")
+
+def _write_ws_upsert(target_ws, rows):
+    """
+    Upsert por (Fecha, Nombre): actualiza en su sitio las filas que cambian y añade
+    las nuevas (valores y formato) con un único batchUpdate. Un 'NO HAY DATOS' previo de la fecha se
+    reutiliza para su primera fila real, y no se añade 'NO HAY DATOS' a una fecha
+    que ya tiene datos.
+    """
+    index, last = _load_sheet_index(target_ws)
+    dates_with_data = {k.split("|", 1)[0] for k in index if not k.endswith("|" + NO_DATA)}
+    sid, updates, first_new = target_ws.id, [], None
+    if last == 1 and not index:
+        updates.append(_update_cells(sid, 0, [HEADER], header=True))
+    for r in rows:
+        key, digest = _row_key(r), _row_digest(r)
+        if r[1] == NO_DATA and str(_serial(r[0])) in dates_with_data: continue
+        pos = index.get(key, [None])[0]
+        if pos is None and r[1] != NO_DATA:
+            pos = index.pop(f"{_serial(r[0])}|{NO_DATA}", [None])[0]
+        if pos is None:
+            last += 1; pos = last
+            first_new = first_new or pos
+        elif index.get(key, [None, None])[1] == digest:
+            continue
+        index[key] = [pos, digest]
+        updates.append(_update_cells(sid, pos - 1, [r]))
+
+    # Valores, formatos y filas extra de la rejilla: una sola petición
+    if updates:
+        target_ws.spreadsheet.batch_update({"requests": _grow_rows(target_ws, last) + updates})
+    _save_sheet_index(target_ws, index, last)
+    print(f"[SHEETS] Upsert: {len(updates)} filas escritas ({last - first_new + 1 if first_new else 0} nuevas)")
+
+def no_data_frame(data_date: datetime) -> pd.DataFrame:
+    """Una sola fila 'NO HAY DATOS' para la fecha dada."""
+    return pd.DataFrame([[ymd(data_date), "NO HAY DATOS", None, None, None]], columns=HEADER)
+
+def no_data_rows(data_date: datetime) -> list[list]:
+    return [[ymd(data_date), NO_DATA, "", "", ""]]
+
+def _publish(rows: list[list]):
+    """Destino de las filas: nada (DRY_RUN), CSV local (OUTPUT_CSV) o la hoja; y el histórico local."""
+    if DRY_RUN:
+        print(f"[DRY_RUN] {len(rows)} filas (no se escribe nada):")
+        for r in rows: print("   ", r)
+        if ALL_MEDIA: print(f"[DRY_RUN] Todos los medios: {sum(map(len, ALL_MEDIA_FRAMES))} filas")
+        return
+    append_history(rows)
+    if OUTPUT_CSV:
+        with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows([HEADER] + rows)
+        print(f"[CSV] {len(rows)} filas -> {OUTPUT_CSV}")
+    else:
+        _publish_sheet(_to_serial_rows(rows))
+        mark_published(rows)
+    if ALL_MEDIA: publish_all_media()
+
+def publish_all_media():
+    """
+    Tablas completas de la ejecución (ALL_MEDIA) -> histórico, CSV '<nombre>_todos' o
+    SHEET_TAB_ALL (con el mismo WRITE_MODE y control de cambios que la pestaña principal).
+    """
+    if not ALL_MEDIA_FRAMES: return
+    df = pd.concat(ALL_MEDIA_FRAMES, ignore_index=True)
+    ALL_MEDIA_FRAMES.clear()
+    rows = df.astype(object).where(pd.notna(df), "").values.tolist()
+    append_history(rows, table="ojd_daily_all")
+    if OUTPUT_CSV:
+        path = pathlib.Path(OUTPUT_CSV); path = path.with_name(f"{path.stem}_todos{path.suffix}")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows([HEADER] + rows)
+        print(f"[CSV] Todos los medios: {len(rows)} filas -> {path}")
+    else:
+        if _publish_sheet(_to_serial_rows(rows), SHEET_TAB_ALL):
+            print(f"[SHEETS] Todos los medios: {len(rows)} filas -> {SHEET_TAB_ALL}")
+
+def _publish_sheet(serial_rows: list[list], tab: str = SHEET_TAB) -> bool:
+    """
+    Escribe en la pestaña `tab` (WRITE_MODE: replace o upsert) salvo que cada fecha tenga
+    el mismo hash que en la última publicación en ella (en modo replace, además, el mismo
+    conjunto de fechas en la hoja). True si ha escrito.
+    """
+    hashes = date_hashes(serial_rows)
+    state = load_state()
+    slot = _state_slot(tab)
+    published = state.setdefault("published", {}).get(slot, {})
+    same_dates = WRITE_MODE == "upsert" or set(published) == set(hashes)
+    if not FORCE_WRITE and same_dates and all(published.get(d) == h for d, h in hashes.items()):
+        print(f"[SKIP] {tab}: datos sin cambios respecto a la última publicación: no se escribe en Sheets.")
+        count("sheets_write_skipped")
+        return False
+    with stage("sheets_write" if tab == SHEET_TAB else "sheets_write_all_media"):
+        if WRITE_MODE == "upsert":
+            _write_ws_upsert(get_ws(tab), serial_rows)
+            published.update(hashes)
+        else:
+            _write_ws_with_formats_overwrite(get_ws(tab), [HEADER] + serial_rows)
+            published = hashes
+    state["published"][slot] = published
+    save_state(state)
+    return True
 
 def write_replace_all(df_new: pd.DataFrame):
     """Siempre sobreescribe con los datos de esta ejecución."""
-    header = ["Fecha","Nombre","Navegadores Únicos","Visitas","Páginas Vistas"]
-    rows = df_new.astype(object).where(pd.notna(df_new), "").values.tolist()
-    _write_ws_with_formats_overwrite(ws, [header] + _to_serial_rows(rows))
+    _publish(df_new.astype(object).where(pd.notna(df_new), "").values.tolist())
+
+def write_frames(frames: list):
+    """Salidas por fecha -> una sola escritura (listas de filas en modo LEAN, DataFrames si no)."""
+    if LEAN: _publish([r for f in frames for r in f])
+    else: write_replace_all(pd.concat(frames, ignore_index=True))
 
 def write_no_data_overwrite(data_date: datetime):
     """Cuando no hay datos, sobreescribe con una sola fila 'NO HAY DATOS'."""
-    header = ["Fecha","Nombre","Navegadores Únicos","Visitas","Páginas Vistas"]
-    row = [ymd(data_date), "NO HAY DATOS", "", "", ""]
-    _write_ws_with_formats_overwrite(ws, [header, row])
+    _publish(no_data_rows(data_date))
+
+# ========================== ESTADO LOCAL ==========================
+def load_state() -> dict:
+    try:
+        return json_loads(STATE_FILE.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_state(state: dict):
+    try:
+        STATE_FILE.write_text(json_dumps(state, indent=1), encoding="utf-8")
+    except OSError as e:
+        print(f"[STATE][WARN] No se pudo guardar el estado: {e}")
+
+def date_hashes(serial_rows) -> dict[str, str]:
+    """{fecha (serial): md5 de sus filas} para detectar publicaciones sin cambios."""
+    by_date = {}
+    for r in serial_rows: by_date.setdefault(str(r[0]), []).append(r)
+    return {d: hashlib.md5(json_dumps(rs, default=str).encode("utf-8")).hexdigest()
+            for d, rs in by_date.items()}
+
+def _ledger(state: dict) -> dict:
+    """{slot: {fecha: instante}}; el formato antiguo (solo por fecha) no dice a qué hoja fue y se descarta."""
+    ledger = state.get("ledger", {})
+    return {k: v for k, v in ledger.items() if isinstance(v, dict)}
+
+def already_published(dt: datetime) -> bool:
+    """True si el ledger local ya registra datos reales publicados para esa fecha en esta hoja/pestaña/modo."""
+    return ymd(dt) in _ledger(load_state()).get(_state_slot(), {})
+
+def mark_published(rows: list[list], keep: int = 90):
+    """Anota en el ledger del slot las fechas publicadas con datos reales (se guardan las `keep` últimas)."""
+    days = {str(r[0]) for r in rows if r[1] != NO_DATA}
+    if not days: return
+    state = load_state()
+    ledger = state["ledger"] = _ledger(state)
+    slot = ledger.setdefault(_state_slot(), {})
+    for d in days: slot[d] = tz_now().isoformat(timespec="seconds")
+    ledger[_state_slot()] = dict(sorted(slot.items())[-keep:])
+    save_state(state)
+
+# ========================== HISTÓRICO LOCAL ==========================
+HISTORY_COLS = {
+    "Fecha": "fecha", "Nombre": "nombre", "Navegadores Únicos": "navegadores_unicos",
+    "Visitas": "visitas", "Páginas Vistas": "paginas_vistas",
+}
+
+HISTORY_TABLES = {"ojd_daily", "ojd_daily_all"}  # medios del catálogo / todos (ALL_MEDIA)
+
+def _history_conn() -> sqlite3.Connection:
+    con = sqlite3.connect(HISTORY_DB)
+    for table in HISTORY_TABLES:
+        con.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+            fecha TEXT NOT NULL, nombre TEXT NOT NULL,
+            navegadores_unicos INTEGER, visitas INTEGER, paginas_vistas INTEGER,
+            PRIMARY KEY (fecha, nombre)) WITHOUT ROWID""")
+    return con
+
+def append_history(rows: list[list], table: str = "ojd_daily"):
+    """Guarda (o reemplaza) las filas por (fecha, medio); las de 'NO HAY DATOS' no se guardan."""
+    data = [(str(r[0]), str(r[1]), *[int(v) if v not in ("", None) else None for v in r[2:5]])
+            for r in rows if r[1] != NO_DATA]
+    if not HISTORY_DB or not data: return
+    try:
+        with closing(_history_conn()) as con, con:
+            con.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?,?,?,?,?)", data)
+    except sqlite3.Error as e:
+        print(f"[HISTORY][WARN] {e}")
+
+def load_history(start: datetime | date, end: datetime | date, columns: list[str] | None = None,
+                 table: str = "ojd_daily") -> pd.DataFrame:
+    """
+    Histórico local entre `start` y `end` (incluidos), con solo las columnas pedidas
+    (nombres de HEADER). Usa la clave primaria (fecha, nombre) para el rango.
+    """
+    if table not in HISTORY_TABLES: raise ValueError(f"Tabla de histórico desconocida: {table}")
+    cols = columns or HEADER
+    select = ", ".join(f'{HISTORY_COLS[c]} AS "{c}"' for c in cols)
+    with closing(_history_conn()) as con:
+        return pd.read_sql_query(
+            f"SELECT {select} FROM {table} WHERE fecha BETWEEN ? AND ? ORDER BY fecha, nombre",
+            con, params=(ymd(start), ymd(end)))
+
+# ========================== SESIÓN ==========================
+def _session_fernet() -> Fernet:
+    if SESSION_CACHE_KEY:
+        return Fernet(SESSION_CACHE_KEY.encode())
+    digest = hashlib.sha256(f"{OJD_USER}\0{OJD_PASS}".encode("utf-8")).digest()
+    return Fernet(base64.urlsafe_b64encode(digest))
+
+def load_session_state() -> dict | None:
+    """storage_state guardado en una ejecución anterior, o None si no hay/no se puede descifrar."""
+    try:
+        return json_loads(_session_fernet().decrypt(SESSION_CACHE.read_bytes()))
+    except FileNotFoundError:
+        return None
+    except (InvalidToken, ValueError) as e:
+        print(f"[SESSION][WARN] Caché de sesión ilegible, se ignora: {type(e).__name__}")
+        return None
+
+def save_session_state(state: dict):
+    try:
+        SESSION_CACHE.write_bytes(_session_fernet().encrypt(json_dumps(state).encode("utf-8")))
+        SESSION_CACHE.chmod(0o600)
+    except Exception as e:
+        print(f"[SESSION][WARN] No se pudo guardar la sesión: {e}")
+
+def is_login_url(url: str) -> bool:
+    return "/login" in url
+
+def on_tm_page(url: str) -> bool:
+    """La página ya está en TM_URL (p. ej. recién abierta por open_session): no hace falta otro goto."""
+    u, tm = urlparse(url), urlparse(TM_URL)
+    return (u.netloc, u.path.rstrip("/")) == (tm.netloc, tm.path.rstrip("/")) and not is_login_url(url)
+
+def is_data_response(resp) -> bool:
+    """Respuesta que puede traer la tabla: documento o XHR/fetch del propio portal."""
+    return (resp.request.resource_type in {"document","xhr","fetch"}
+            and urlparse(resp.url).netloc == urlparse(TM_URL).netloc)
+
+SEARCH_SELECTORS = ["button[type='submit']", "button:has(.fa-search)", "form button.btn"]
+DATE_IS_JS = "([sel, v]) => (document.querySelector(sel)?.value || '').trim() === v"
+
+# ========================== MÉTRICAS ==========================
+# Tiempo por etapa (se suman las llamadas; con hilos/async puede superar el total),
+# contadores de reintentos/recaídas y bytes; se vuelca a debug/run_report_*.json.
+RUN_REPORT = {"stages": {}, "counters": Counter()}
+_report_lock = threading.Lock()
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        with _report_lock:
+            st = RUN_REPORT["stages"].setdefault(name, {"seconds": 0.0, "calls": 0})
+            st["seconds"] += elapsed; st["calls"] += 1
+
+def count(name: str, n: int = 1):
+    with _report_lock:
+        RUN_REPORT["counters"][name] += n
+
+def write_run_report(started: datetime, total: float, status: str) -> pathlib.Path:
+    stats = dict(BLOCK_STATS)
+    report = {
+        "started": started.isoformat(timespec="seconds"), "status": status,
+        "total_seconds": round(total, 3),
+        "config": {"engine": OJD_ENGINE, "backend": OJD_BACKEND, "write_mode": WRITE_MODE,
+                   "backfill_range": BACKFILL_RANGE, "force_date": FORCE_DATE_STR,
+                   "workers": BACKFILL_WORKERS},
+        "stages": {k: {"seconds": round(v["seconds"], 3), "calls": v["calls"]}
+                   for k, v in RUN_REPORT["stages"].items()},
+        "counters": dict(RUN_REPORT["counters"]),
+        "bytes_received": stats.pop("bytes", 0),
+        "blocked_requests": stats,
+    }
+    path = DEBUG_DIR / f"run_report_{started:%Y%m%d_%H%M%S}.json"
+    path.write_text(json_dumps(report, indent=1, ensure_ascii=False), encoding="utf-8")
+    return path
+
+# ========================== BLOQUEO DE RECURSOS ==========================
+BLOCK_STATS = Counter()  # peticiones bloqueadas por tipo + "bytes" de cuerpos recibidos (siempre)
+
+def block_count(key: str, n: int = 1):
+    """BLOCK_STATS lo actualizan a la vez los hilos del backfill: mismo cerrojo que count()."""
+    with _report_lock:
+        BLOCK_STATS[key] += n
+
+def resource_allowed(request) -> bool:
+    """Lista blanca de tipos de recurso y hosts (incluye subdominios); data:/blob: siempre pasan."""
+    if request.url.startswith(("data:", "blob:")): return True
+    if request.resource_type not in ALLOW_RESOURCE_TYPES: return False
+    host = urlparse(request.url).hostname or ""
+    return any(host == h or host.endswith("." + h) for h in ALLOW_HOSTS)
+
+# "bytes" = cuerpos tal como llegan por la red (comprimidos si hay gzip), sin cabeceras:
+# request.sizes() al terminar cada petición en el navegador (sin copiar el cuerpo por el
+# canal de Playwright) y raw.tell() en http_session. Content-Length no vale (no viene en
+# respuestas chunked).
+def _count_bytes(request):
+    try: block_count("bytes", request.sizes()["responseBodySize"])
+    except Exception: pass
+
+async def _count_bytes_async(request):
+    try: block_count("bytes", (await request.sizes())["responseBodySize"])
+    except Exception: pass
+
+def _count_bytes_http(r, *a, **kw):
+    body = r.content  # el hook llega antes de leer el cuerpo
+    # urllib3 no cuenta las respuestas chunked en tell(): ahí, el cuerpo (exacto si no va comprimido)
+    block_count("bytes", (r.raw.tell() if r.raw is not None else 0) or len(body))
+
+def new_context(browser, **kw):
+    """browser.new_context con el bloqueo de recursos instalado."""
+    context = browser.new_context(accept_downloads=True, **kw)
+    if BLOCK_RESOURCES:
+        def handle(route):
+            if resource_allowed(route.request):
+                route.continue_()
+            else:
+                block_count(route.request.resource_type)
+                route.abort()
+        context.route("**/*", handle)
+    context.on("requestfinished", _count_bytes)
+    return context
+
+async def new_context_async(browser, **kw):
+    context = await browser.new_context(accept_downloads=True, **kw)
+    if BLOCK_RESOURCES:
+        async def handle(route):
+            if resource_allowed(route.request):
+                await route.continue_()
+            else:
+                block_count(route.request.resource_type)
+                await route.abort()
+        await context.route("**/*", handle)
+    context.on("requestfinished", _count_bytes_async)
+    return context
+
+def report_blocking():
+    if not BLOCK_RESOURCES: return
+    stats = dict(BLOCK_STATS); kb = stats.pop("bytes", 0) / 1024
+    detail = ", ".join(f"{k}: {v}" for k, v in sorted(stats.items())) or "ninguna"
+    print(f"[BLOCK] Peticiones bloqueadas: {sum(stats.values())} ({detail}); recibido ~{kb:.0f} KB")
 
 # ========================== PLAYWRIGHT ==========================
 def login_tm(page):
@@ -222,15 +792,42 @@ def login_tm(page):
     page.get_by_placeholder("Usuario").fill(OJD_USER)
     page.get_by_placeholder("Contraseña").fill(OJD_PASS)
     page.get_by_role("button", name=re.compile(r"Acceder", re.I)).click()
-    page.wait_for_load_state("networkidle")
+    try:
+        page.wait_for_url(lambda u: not is_login_url(u), timeout=READY_TIMEOUT_MS)
+    except PWTimeout:
+        print("[WARN] El login no salió de la página de acceso.")
+
+def open_session(browser):
+    """
+    Devuelve (context, page) autenticados. Prueba primero la sesión cacheada
+    y solo hace login_tm si TM_URL redirige al login.
+    """
+    state = load_session_state()
+    if state:
+        context = new_context(browser, storage_state=state)
+        page = context.new_page()
+        page.goto(TM_URL, wait_until="domcontentloaded")
+        if not is_login_url(page.url):
+            print("[SESSION] Sesión cacheada válida, se omite el login.")
+            count("session_reused")
+            return context, page
+        print("[SESSION] Sesión cacheada caducada -> login.")
+        count("session_expired")
+        context.close()
+    context = new_context(browser)
+    page = context.new_page()
+    login_tm(page)
+    if not is_login_url(page.url):
+        save_session_state(context.storage_state())
+    return context, page
 
 def set_date_and_search(page, dt: datetime) -> bool:
     """
     Escribe la fecha en #datepicker (dd/mm/yyyy), verifica que quedó escrita
     y pulsa el botón Buscar (icono lupa). Devuelve True si parece haber recargado.
     """
-    page.goto(TM_URL, wait_until="domcontentloaded")
-    page.wait_for_load_state("networkidle")
+    if not on_tm_page(page.url):
+        page.goto(TM_URL, wait_until="domcontentloaded")
 
     wanted = dmy(dt)
     inp = page.locator("#datepicker")
@@ -245,23 +842,19 @@ def set_date_and_search(page, dt: datetime) -> bool:
     except PWTimeout:
         return False
 
-    # Confirmar valor
-    ok = False
-    for _ in range(4):
-        try:
-            val = inp.input_value(timeout=2000)
-            if val.strip() == wanted:
-                ok = True
-                break
-            time.sleep(0.4)
-        except:
-            time.sleep(0.4)
-    if not ok:
+    # Confirmar valor (espera al propio input, sin sondeo con sleep)
+    try:
+        page.wait_for_function(DATE_IS_JS, arg=["#datepicker", wanted], timeout=2000)
+    except PWTimeout:
         print(f"[WARN] No se pudo fijar la fecha correcta. Quedó: '{inp.input_value()}'")
+        count("date_not_confirmed")
 
-    # Pulsar Buscar
+    # Pulsar Buscar y esperar lo primero que llegue: tabla cambiada, documento nuevo o
+    # respuesta XHR/fetch seguida de TABLE_SETTLE_MS sin cambios (misma fecha ya mostrada)
+    before = table_fingerprint(page)
+    page.evaluate(SEARCH_MARK_JS)
     clicked = False
-    for sel in ["button[type='submit']", "button:has(.fa-search)", "form button.btn"]:
+    for sel in SEARCH_SELECTORS:
         loc = page.locator(sel)
         if loc.count():
             loc.first.click()
@@ -269,11 +862,39 @@ def set_date_and_search(page, dt: datetime) -> bool:
             break
     if not clicked:
         inp.press("Enter")
-
-    page.wait_for_load_state("networkidle")
-    time.sleep(1.0)
+    try:
+        how = page.wait_for_function(SEARCH_DONE_JS, arg=[*before, TABLE_SETTLE_MS],
+                                     timeout=READY_TIMEOUT_MS).json_value()
+    except PWTimeout:
+        how = None
+    page.wait_for_load_state("domcontentloaded")
+    if how == "navigated" and table_fingerprint(page) != before: how = "changed"
+    search_outcome(how)
     return True
 
+def search_outcome(how: str | None):
+    """Avisos y contadores según cómo terminó la espera de SEARCH_DONE_JS."""
+    if how is None:
+        print("[WARN] Ni la tabla cambió ni llegó respuesta de datos tras Buscar.")
+        count("search_no_response")
+    elif how != "changed":
+        print("[WARN] La tabla de datos no cambió tras Buscar (misma fecha ya mostrada).")
+        count("table_unchanged")
+
+def wait_table_change(page, before: tuple[int | None, str]) -> bool:
+    """
+    Espera, con una sola wait_for_function en la página, a que la tabla elegida cambie
+    respecto a `before` (table_fingerprint), como mucho TABLE_SETTLE_MS. False si no cambió:
+    la fecha ya era la mostrada o los datos no han llegado.
+    """
+    try:
+        page.wait_for_function(TABLE_CHANGED_JS, arg=list(before), timeout=TABLE_SETTLE_MS)
+        changed = True
+    except PWTimeout:
+        changed = False
+    page.wait_for_load_state("domcontentloaded")
+    return changed
+
 def read_final_date_from_page(page) -> datetime | None:
     """Lee el valor actual del #datepicker y lo convierte a datetime."""
     try:
@@ -282,85 +903,819 @@ def read_final_date_from_page(page) -> datetime | None:
     except Exception:
         return None
 
-def table_fingerprint(page) -> str:
+def table_fingerprint(page) -> tuple[int | None, str]:
+    """(índice de la tabla de datos según best_header, huella de su texto); (None, "") si no hay."""
+    try:
+        i = best_header(page.evaluate(TABLE_HEADERS_JS))
+        return (i, page.evaluate(TABLE_FP_JS, i)) if i is not None else (None, "")
+    except Exception:
+        return None, ""
+
+# Cabeceras de todas las tablas (última fila del thead o primera fila) y filas de una sola
+TABLE_HEADERS_JS = """() => Array.from(document.querySelectorAll('table'), t => {
+  const h = t.tHead && t.tHead.rows.length ? t.tHead.rows[t.tHead.rows.length - 1] : t.rows[0];
+  return h ? Array.from(h.cells, c => c.textContent.replace(/\\s+/g, ' ').trim()) : [];
+})"""
+TABLE_ROWS_JS = """(i) => {
+  const t = document.querySelectorAll('table')[i];
+  const rows = t.tHead && t.tHead.rows.length
+    ? Array.from(t.tBodies).flatMap(b => Array.from(b.rows)) : Array.from(t.rows).slice(1);
+  return rows.map(r => Array.from(r.cells, c => c.textContent.replace(/\\s+/g, ' ').trim()));
+}"""
+
+# Huella (longitud + hash del texto) de la tabla i; "cambió" = la tabla i existe y su
+# huella difiere (sin tabla elegida antes, basta con que aparezca una tabla con filas)
+_FP_JS = """t => { const s = t ? t.textContent : ''; let h = 0;
+  for (let k = 0; k < s.length; k++) h = (h * 31 + s.charCodeAt(k)) | 0;
+  return s.length + ':' + h; }"""
+TABLE_FP_JS = f"(i) => ({_FP_JS})(document.querySelectorAll('table')[i])"
+TABLE_CHANGED_JS = f"""([i, before]) => {{
+  if (i === null) return !!document.querySelector('table tbody tr, table tr + tr');
+  const t = document.querySelectorAll('table')[i];
+  return !!t && ({_FP_JS})(t) !== before;
+}}"""
+
+# Búsqueda: marca antes de pulsar Buscar (y vacía el buffer de Resource Timing, que
+# se llena a las 250 entradas) y espera única a lo primero de: "changed" (la tabla
+# elegida cambió), "navigated" (documento nuevo: la marca ya no existe) o "response"
+# (terminó un XHR/fetch lanzado tras la marca y la tabla lleva `settle` ms sin cambiar).
+# No depende del formato en que la petición lleve la fecha.
+SEARCH_MARK_JS = "() => { performance.clearResourceTimings(); window.__ojdSearch = performance.now(); }"
+SEARCH_DONE_JS = f"""([i, before, settle]) => {{
+  const t0 = window.__ojdSearch;
+  if (t0 === undefined) return document.readyState !== 'loading' && 'navigated';
+  if (({TABLE_CHANGED_JS})([i, before])) return 'changed';
+  const ends = performance.getEntriesByType('resource')
+    .filter(e => (e.initiatorType === 'xmlhttprequest' || e.initiatorType === 'fetch') && e.startTime >= t0)
+    .map(e => e.responseEnd);
+  return ends.length > 0 && performance.now() - Math.max(...ends) > settle && 'response';
+}}"""
+
+def best_header(headers: list[list[str]]) -> int | None:
+    """Índice de la tabla cuya cabecera puntúa más en table_score (None si no hay tablas)."""
+    best, score_best = None, -1
+    for i, h in enumerate(headers):
+        if not h: continue
+        score = table_score(h)
+        if score > score_best:
+            best, score_best = i, score
+    return best
+
+@dataclass(slots=True)
+class Cells:
+    """Tabla leída como texto (cabecera + filas), con .columns/.empty como un DataFrame."""
+    columns: list[str]
+    rows: list[list[str | None]]
+
+    @property
+    def empty(self) -> bool:
+        return not self.rows
+
+def cells_from(header: list[str], rows: list[list[str]]) -> Cells:
+    """Celdas planas -> Cells (cabeceras vacías/duplicadas renombradas, filas al ancho de la cabecera)."""
+    cols, seen = [], Counter()
+    for i, h in enumerate(header):
+        h = h or f"Unnamed: {i}"
+        cols.append(h if not seen[h] else f"{h}.{seen[h]}"); seen[h] += 1
+    n = len(cols)
+    return Cells(cols, [r[:n] + [None] * (n - len(r)) for r in rows if r])
+
+def to_frame(t: Cells) -> pd.DataFrame:
+    return pd.DataFrame(t.rows, columns=t.columns) if t.columns else pd.DataFrame()
+
+def read_cells(page) -> Cells:
+    """
+    Extracción acotada: lee las cabeceras de todas las tablas y solo las filas de la
+    elegida, como arrays planos. Si falla, vuelve al HTML completo (cells_from_html).
+    """
     try:
-        tbl = page.locator("table").first
-        if not tbl.count(): return ""
-        html = tbl.inner_html()
-        return hashlib.md5(html.encode("utf-8", errors="ignore")).hexdigest()
-    except:
-        return ""
+        headers = page.evaluate(TABLE_HEADERS_JS)
+        i = best_header(headers)
+        if i is None: return Cells([], [])
+        return cells_from(headers[i], page.evaluate(TABLE_ROWS_JS, i))
+    except Exception as e:
+        print(f"[WARN] Extracción acotada fallida ({type(e).__name__}); se usa el HTML completo.")
+        count("table_html_fallback")
+        return cells_from_html(page.content())
 
 def read_table(page) -> pd.DataFrame:
-    html = page.content()
+    return to_frame(read_cells(page))
+
+# DataTables: todas las filas en una sola página (page.len(-1)); si no, el mayor
+# tamaño de un <select> cuyas opciones son todas tamaños de página típicos.
+PAGE_ALL_JS = """() => {
+  const $ = window.jQuery;
+  if (!$ || !$.fn || !$.fn.dataTable) return false;
+  let done = false;
+  $('table').each((_, t) => {
+    if ($.fn.dataTable.isDataTable(t)) { $(t).DataTable().page.len(-1).draw(); done = true; }
+  });
+  return done;
+}"""
+PAGE_SIZE_JS = """() => {
+  const sizes = new Set([5, 10, 15, 20, 25, 30, 50, 100, 200, 250, 500, 1000, -1]);
+  for (const s of document.querySelectorAll('select')) {
+    const vals = Array.from(s.options, o => parseInt(o.value, 10));
+    if (vals.length < 2 || !vals.every(v => sizes.has(v))) continue;
+    const best = vals.includes(-1) ? -1 : Math.max(...vals);
+    if (parseInt(s.value, 10) === best) return false;
+    s.value = String(best);
+    s.dispatchEvent(new Event('change', {bubbles: true}));
+    return true;
+  }
+  return false;
+}"""
+NEXT_PAGE_SELECTORS = [".paginate_button.next:not(.disabled)", ".pagination .next:not(.disabled) a",
+                       "a[rel='next']"]
+
+def merge_cells(pages: list[Cells]) -> Cells:
+    """Filas de todas las páginas sin duplicados, en orden (motores sync y async)."""
+    pages = [t for t in pages if not t.empty]
+    if len(pages) <= 1: return pages[0] if pages else Cells([], [])
+    rows = dict.fromkeys(tuple(r) for t in pages for r in t.rows)
+    return Cells(pages[0].columns, [list(r) for r in rows])
+
+def read_table_all_pages(page) -> pd.DataFrame:
+    return to_frame(read_cells_all_pages(page))
+
+def read_cells_all_pages(page) -> Cells:
+    """
+    read_cells sobre todas las páginas del listado: primero intenta ver todas las filas
+    de una vez (tamaño de página máximo) y, si sigue habiendo «siguiente», recorre las
+    páginas. Una huella de tabla repetida corta el recorrido; las filas se deduplican.
+    """
+    if not PAGINATE: return read_cells(page)
+    before = table_fingerprint(page)
+    try:
+        expanded = page.evaluate(PAGE_ALL_JS) or page.evaluate(PAGE_SIZE_JS)
+    except Exception:
+        expanded = False
+    if expanded: wait_table_change(page, before)
+
+    frames, seen = [], set()
+    for _ in range(MAX_PAGES):
+        fp = table_fingerprint(page)
+        if fp in seen: break
+        seen.add(fp)
+        frames.append(read_cells(page))
+        nxt = next((page.locator(sel).first for sel in NEXT_PAGE_SELECTORS if page.locator(sel).count()), None)
+        if nxt is None: break
+        nxt.click()
+        wait_table_change(page, fp)
+    count("table_pages", len(frames))
+    if len(frames) > 1: print(f"[INFO] Tabla paginada: {len(frames)} páginas leídas.")
+    return merge_cells(frames)
+
+@contextmanager
+def record_feed(page):
+    """Acumula las respuestas JSON del portal (XHR/fetch) mientras dura el bloque."""
+    responses = []
+    def on_response(resp):
+        if (resp.request.resource_type in {"xhr","fetch"} and is_data_response(resp)
+                and "json" in (resp.headers.get("content-type") or "")):
+            responses.append(resp)
+    page.on("response", on_response)
+    try:
+        yield responses
+    finally:
+        page.remove_listener("response", on_response)
+
+def feed_payloads(responses) -> list:
+    out = []
+    for r in responses:
+        try: out.append(r.json())
+        except Exception: pass
+    return out
+
+def _json_tables(obj):
+    """Listas de registros dentro de un JSON: [{...}, ...] o {"columns": [...], "data": [[...]]}."""
+    if isinstance(obj, list):
+        if obj and all(isinstance(x, dict) for x in obj):
+            yield pd.DataFrame(obj)
+            return
+        for x in obj:
+            if isinstance(x, (list, dict)): yield from _json_tables(x)
+    elif isinstance(obj, dict):
+        cols, rows = obj.get("columns"), obj.get("data") or obj.get("rows")
+        if (isinstance(cols, list) and isinstance(rows, list) and rows
+                and all(isinstance(r, list) and len(r) == len(cols) for r in rows)):
+            names = [c.get("title") or c.get("data") if isinstance(c, dict) else c for c in cols]
+            yield pd.DataFrame(rows, columns=[str(n) for n in names])
+            return
+        for v in obj.values():
+            if isinstance(v, (list, dict)): yield from _json_tables(v)
+
+def feed_total(payload) -> int | None:
+    """Filas que declara un feed paginado en el servidor (DataTables: recordsFiltered/recordsTotal)."""
+    if not isinstance(payload, dict): return None
+    for k in ("recordsFiltered", "iTotalDisplayRecords", "recordsTotal", "iTotalRecords"):
+        try: return int(payload[k])
+        except (KeyError, TypeError, ValueError): pass
+    return None
+
+def table_from_feed(payloads: list) -> pd.DataFrame:
+    """
+    Tabla de tráfico a partir del JSON capturado (el último payload válido gana).
+    Los números llegan ya como enteros: sin adivinar separadores de miles. Vacía si
+    no hay JSON reconocible o si el feed trae solo una página de las que declara:
+    entonces se lee la tabla HTML recorriendo la paginación.
+    """
+    for payload in reversed(payloads):
+        tables = [t for t in _json_tables(payload) if table_score(t.columns) >= 2]
+        if not tables: continue
+        t = pick_table(tables)
+        total = feed_total(payload)
+        if total is not None and total > len(t):
+            print(f"[FEED] JSON paginado en el servidor ({len(t)} de {total} filas); se usa la tabla HTML.")
+            count("feed_partial")
+            return pd.DataFrame()
+        # 1234.0 -> 1234 como int de Python, para que to_int no lo trate como "12340"
+        return t.apply(lambda c: c.astype("Int64").astype(object)
+                       if c.dtype.kind == "f" and (c.dropna() % 1 == 0).all() else c)
+    print("[FEED] Sin JSON reconocible; se usa la tabla HTML.")
+    return pd.DataFrame()
+
+def _html_cells(tr) -> list[str]:
+    return [" ".join(c.text_content().split()) for c in tr if c.tag in ("th", "td")]
+
+def _html_header(t) -> list[str]:
+    """Como TABLE_HEADERS_JS: última fila del thead o, si no hay, la primera fila."""
+    rows = t.xpath("./thead/tr") or t.xpath("./tbody/tr|./tr")[:1]
+    return _html_cells(rows[-1]) if rows else []
+
+def _html_body(t) -> list:
+    """Como TABLE_ROWS_JS: filas de los tbody (con thead) o todas menos la primera."""
+    if t.xpath("./thead/tr"): return t.xpath("./tbody/tr|./tr")
+    return t.xpath("./tbody/tr|./tr|./tfoot/tr")[1:]
+
+def cells_from_html(html: str) -> Cells:
+    """
+    Equivalente de read_cells sobre el HTML: elige la tabla puntuando solo sus
+    cabeceras y extrae únicamente las filas de la elegida.
+    """
+    try:
+        doc = lxml.html.fromstring(html)
+    except (lxml.etree.ParserError, ValueError):
+        return Cells([], [])
+    tables = doc.xpath("//table")
+    i = best_header([_html_header(t) for t in tables])
+    if i is None: return Cells([], [])
+    return cells_from(_html_header(tables[i]), [_html_cells(tr) for tr in _html_body(tables[i])])
+
+def table_from_html(html: str) -> pd.DataFrame:
+    return to_frame(cells_from_html(html))
+
+# ========================== PLAYWRIGHT (async) ==========================
+async def login_tm_async(page):
+    await page.goto(LOGIN_URL, wait_until="domcontentloaded")
+    # cookies (si aparecen)
+    for txt in ["ACEPTAR TODO","Aceptar todo","Aceptar cookies","RECHAZAR","Rechazar todo"]:
+        try:
+            b = page.get_by_role("button", name=re.compile(txt, re.I))
+            if await b.count(): await b.first.click(); break
+        except: pass
+    await page.get_by_placeholder("Usuario").fill(OJD_USER)
+    await page.get_by_placeholder("Contraseña").fill(OJD_PASS)
+    await page.get_by_role("button", name=re.compile(r"Acceder", re.I)).click()
+    try:
+        await page.wait_for_url(lambda u: not is_login_url(u), timeout=READY_TIMEOUT_MS)
+    except PWTimeout:
+        print("[WARN] El login no salió de la página de acceso.")
+
+async def open_session_async(browser):
+    """Versión asyncio de open_session."""
+    state = load_session_state()
+    if state:
+        context = await new_context_async(browser, storage_state=state)
+        page = await context.new_page()
+        await page.goto(TM_URL, wait_until="domcontentloaded")
+        if not is_login_url(page.url):
+            print("[SESSION] Sesión cacheada válida, se omite el login.")
+            count("session_reused")
+            return context, page
+        print("[SESSION] Sesión cacheada caducada -> login.")
+        count("session_expired")
+        await context.close()
+    context = await new_context_async(browser)
+    page = await context.new_page()
+    await login_tm_async(page)
+    if not is_login_url(page.url):
+        save_session_state(await context.storage_state())
+    return context, page
+
+async def set_date_and_search_async(page, dt: datetime) -> bool:
+    """Versión asyncio de set_date_and_search (mismos pasos y reintentos)."""
+    if not on_tm_page(page.url):
+        await page.goto(TM_URL, wait_until="domcontentloaded")
+
+    wanted = dmy(dt)
+    inp = page.locator("#datepicker")
+    await inp.wait_for(state="visible", timeout=8000)
+
+    try:
+        await inp.fill("")
+        await inp.fill(wanted)
+        await inp.press("Control+a")
+        await inp.type(wanted, delay=20)
+    except PWTimeout:
+        return False
+
+    try:
+        await page.wait_for_function(DATE_IS_JS, arg=["#datepicker", wanted], timeout=2000)
+    except PWTimeout:
+        print(f"[WARN] No se pudo fijar la fecha correcta. Quedó: '{await inp.input_value()}'")
+        count("date_not_confirmed")
+
+    before = await table_fingerprint_async(page)
+    await page.evaluate(SEARCH_MARK_JS)
+    clicked = False
+    for sel in SEARCH_SELECTORS:
+        loc = page.locator(sel)
+        if await loc.count():
+            await loc.first.click()
+            clicked = True
+            break
+    if not clicked:
+        await inp.press("Enter")
+    try:
+        how = await (await page.wait_for_function(SEARCH_DONE_JS, arg=[*before, TABLE_SETTLE_MS],
+                                                  timeout=READY_TIMEOUT_MS)).json_value()
+    except PWTimeout:
+        how = None
+    await page.wait_for_load_state("domcontentloaded")
+    if how == "navigated" and await table_fingerprint_async(page) != before: how = "changed"
+    search_outcome(how)
+    return True
+
+async def table_fingerprint_async(page) -> tuple[int | None, str]:
+    try:
+        i = best_header(await page.evaluate(TABLE_HEADERS_JS))
+        return (i, await page.evaluate(TABLE_FP_JS, i)) if i is not None else (None, "")
+    except Exception:
+        return None, ""
+
+async def wait_table_change_async(page, before: tuple[int | None, str]) -> bool:
+    try:
+        await page.wait_for_function(TABLE_CHANGED_JS, arg=list(before), timeout=TABLE_SETTLE_MS)
+        changed = True
+    except PWTimeout:
+        changed = False
+    await page.wait_for_load_state("domcontentloaded")
+    return changed
+
+async def read_final_date_from_page_async(page) -> datetime | None:
+    try:
+        val = (await page.locator("#datepicker").input_value(timeout=4000)).strip()
+        return parse_dmy(val)
+    except Exception:
+        return None
+
+async def read_cells_async(page) -> Cells:
+    """Versión asyncio de read_cells (extracción acotada a la tabla elegida)."""
+    try:
+        headers = await page.evaluate(TABLE_HEADERS_JS)
+        i = best_header(headers)
+        if i is None: return Cells([], [])
+        return cells_from(headers[i], await page.evaluate(TABLE_ROWS_JS, i))
+    except Exception as e:
+        print(f"[WARN] Extracción acotada fallida ({type(e).__name__}); se usa el HTML completo.")
+        count("table_html_fallback")
+        html = await page.content()
+        # El parseo (lxml) va a un hilo para no bloquear al resto de páginas
+        return await asyncio.to_thread(cells_from_html, html)
+
+async def read_cells_all_pages_async(page) -> Cells:
+    """Versión asyncio de read_cells_all_pages."""
+    if not PAGINATE: return await read_cells_async(page)
+    before = await table_fingerprint_async(page)
+    try:
+        expanded = await page.evaluate(PAGE_ALL_JS) or await page.evaluate(PAGE_SIZE_JS)
+    except Exception:
+        expanded = False
+    if expanded: await wait_table_change_async(page, before)
+
+    frames, seen = [], set()
+    for _ in range(MAX_PAGES):
+        fp = await table_fingerprint_async(page)
+        if fp in seen: break
+        seen.add(fp)
+        frames.append(await read_cells_async(page))
+        nxt = None
+        for sel in NEXT_PAGE_SELECTORS:
+            if await page.locator(sel).count():
+                nxt = page.locator(sel).first
+                break
+        if nxt is None: break
+        await nxt.click()
+        await wait_table_change_async(page, fp)
+    count("table_pages", len(frames))
+    if len(frames) > 1: print(f"[INFO] Tabla paginada: {len(frames)} páginas leídas.")
+    return merge_cells(frames)
+
+async def frame_for_date_async(page, dt: datetime) -> pd.DataFrame:
+    """Equivalente async de frame_for_date."""
+    with (record_feed(page) if CAPTURE_FEED else nullcontext([])) as responses:
+        with stage("set_date_and_search"):
+            ok = await set_date_and_search_async(page, dt)
+    if not ok:
+        print(f"[ERR] No fue posible preparar el filtro de fecha {ymd(dt)}.")
+        return no_data_frame(dt)
+    real_dt = await read_final_date_from_page_async(page) or dt
+    print(f"[INFO] Fecha confirmada en página: {ymd(real_dt)}")
+    df = pd.DataFrame()
+    if CAPTURE_FEED:
+        payloads = []
+        for r in responses:
+            try: payloads.append(await r.json())
+            except Exception: pass
+        df = table_from_feed(payloads)
+    if df.empty:
+        with stage("read_table"):
+            df = to_frame(await read_cells_all_pages_async(page))
+    out = shape_table(df, real_dt)
+    return out if not out.empty else no_data_frame(real_dt)
+
+async def run_async(dates: list[datetime]):
+    """
+    Un navegador, un login y BACKFILL_WORKERS páginas del mismo contexto
+    consumiendo fechas en un solo event loop. La escritura en Sheets
+    (bloqueante) va a un hilo y se solapa con el cierre del navegador.
+    """
+    workers = min(BACKFILL_WORKERS, len(dates))
+    print(f"[INFO] Motor async: {len(dates)} fechas, {workers} páginas")
+    q = asyncio.Queue()
+    for dt in dates: q.put_nowait(dt)
+    results = {}
+
+    async def worker(page):
+        while not q.empty():
+            dt = q.get_nowait()
+            try:
+                results[dt] = await frame_for_date_async(page, dt)
+            except Exception as e:
+                results[dt] = date_failed(dt, e)
+
+    async with async_playwright() as p:
+        with stage("chromium_launch"):
+            browser = await p.chromium.launch(headless=True)
+        with stage("login"):
+            context, page = await open_session_async(browser)
+        pages = [page] + [await context.new_page() for _ in range(workers - 1)]
+        await asyncio.gather(*(worker(pg) for pg in pages))
+
+        df = pd.concat([results[dt] for dt in dates], ignore_index=True)
+        await asyncio.gather(asyncio.to_thread(write_replace_all, df), browser.close())
+    report_blocking()
+    print(f"[DONE] OK ({len(dates)} fechas)")
+
+# ========================== HTTP (sin navegador) ==========================
+def http_session() -> requests.Session:
+    """Sesión con pool de conexiones; reutiliza las cookies de la sesión cacheada si las hay."""
+    sess = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(4, BACKFILL_WORKERS))
+    sess.mount("https://", adapter); sess.mount("http://", adapter)
+    sess.headers["User-Agent"] = "Mozilla/5.0 (X11; Linux x86_64) ojd_export"
+    sess.hooks["response"].append(_count_bytes_http)
+    for c in (load_session_state() or {}).get("cookies", []):
+        sess.cookies.set(c["name"], c["value"], domain=c.get("domain"), path=c.get("path", "/"))
+    return sess
+
+def _form_with(doc, xpath: str):
+    """Primer <form> que contiene el elemento indicado (o None)."""
+    for el in doc.xpath(xpath):
+        form = next((a for a in el.iterancestors() if a.tag == "form"), None)
+        if form is not None: return form
+    return None
+
+def _submit(sess: requests.Session, form, data: dict) -> requests.Response:
+    url = form.action or form.base_url
+    if (form.method or "GET").upper() == "POST":
+        return sess.post(url, data=data, timeout=HTTP_TIMEOUT)
+    return sess.get(url, params=data, timeout=HTTP_TIMEOUT)
+
+def _doc(r: requests.Response):
+    doc = lxml.html.fromstring(r.text, base_url=r.url); doc.make_links_absolute(r.url)
+    return doc
+
+def http_login(sess: requests.Session, r: requests.Response | None = None) -> requests.Response | None:
+    """
+    Reproduce el formulario de login_tm sobre `r` (la página de acceso a la que ya redirigió
+    TM_URL; si no se pasa, se pide LOGIN_URL). Devuelve la respuesta final del envío, o
+    None si sigue en la página de acceso.
+    """
+    if r is None or not is_login_url(r.url):
+        r = sess.get(LOGIN_URL, timeout=HTTP_TIMEOUT)
+    form = _form_with(_doc(r), "//input[@placeholder='Usuario']")
+    if form is None: return None
+    data = dict(form.form_values())
+    for ph, val in (("Usuario", OJD_USER), ("Contraseña", OJD_PASS)):
+        for el in form.xpath(f".//input[@placeholder='{ph}']"):
+            if el.get("name"): data[el.get("name")] = val
+    for b in form.xpath(".//button[@name]"):
+        if re.search(r"Acceder", b.text_content(), re.I): data[b.get("name")] = b.get("value", "")
+    r = _submit(sess, form, data)
+    if is_login_url(r.url): return None
+    save_session_state({"cookies": [
+        {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+         "expires": c.expires or -1, "httpOnly": False, "secure": bool(c.secure), "sameSite": "Lax"}
+        for c in sess.cookies], "origins": []})
+    return r
+
+def search_form(r: requests.Response):
+    """(formulario de #datepicker, sus valores, nombre del campo) de una respuesta de TM_URL."""
+    if is_login_url(r.url):
+        raise RuntimeError("sesión HTTP no válida")
+    doc = _doc(r)
+    form = _form_with(doc, "//*[@id='datepicker']")
+    field = doc.xpath("//*[@id='datepicker']/@name")
+    if form is None or not field:
+        raise RuntimeError("formulario de fecha no encontrado")
+    return form, dict(form.form_values()), field[0]
+
+def http_fetch(sess: requests.Session, search, dt: datetime) -> tuple[datetime, Cells | pd.DataFrame]:
+    """
+    Equivalente HTTP de set_date_and_search + read_table: envía el formulario de
+    #datepicker (search_form, leído una vez para todas las fechas) y lee la tabla de la
+    respuesta. Devuelve (fecha real, tabla; Cells en modo LEAN).
+    """
+    form, data, field = search
+    r = _submit(sess, form, {**data, field: dmy(dt)})
+    r.raise_for_status()
+    if is_login_url(r.url):
+        raise RuntimeError("sesión HTTP no válida")
+    shown = lxml.html.fromstring(r.text).xpath("//*[@id='datepicker']/@value")
+    real_dt = (parse_dmy(shown[0]) if shown else None) or dt
+    return real_dt, (cells_from_html(r.text) if LEAN else table_from_html(r.text))
+
+def scrape_http(dates: list[datetime]) -> list | None:
+    """
+    Salidas por fecha (como frame_for_date; filas en modo LEAN) sin navegador,
+    o None si el modo HTTP no sirve. Con None se descartan también las tablas de
+    ALL_MEDIA_FRAMES que añadió, para que el respaldo con Playwright no las duplique.
+    """
+    n_all = len(ALL_MEDIA_FRAMES)
+    frames = _scrape_http(dates)
+    if frames is None: del ALL_MEDIA_FRAMES[n_all:]
+    return frames
+
+def _scrape_http(dates: list[datetime]) -> list | None:
     try:
-        tables = pd.read_html(html)
-    except ValueError:
+        sess = http_session()
+        # La sonda de la sesión es también la página del formulario (o la de acceso)
+        r = sess.get(TM_URL, timeout=HTTP_TIMEOUT)
+        if is_login_url(r.url):
+            r = http_login(sess, r)
+            if r is None:
+                print("[HTTP][WARN] Login HTTP fallido.")
+                return None
+            if not on_tm_page(r.url): r = sess.get(TM_URL, timeout=HTTP_TIMEOUT)
+        search = search_form(r)
+        frames, got_data = [], False
+        for dt in dates:
+            real_dt, df = http_fetch(sess, search, dt)
+            print(f"[HTTP] Fecha confirmada en página: {ymd(real_dt)}")
+            out = shape_rows(df, real_dt) if LEAN else shape_table(df, real_dt)
+            got_data = got_data or len(out) > 0
+            frames.append(out if len(out) else no_data_rows(real_dt) if LEAN else no_data_frame(real_dt))
+    except (requests.RequestException, RuntimeError) as e:
+        print(f"[HTTP][WARN] {e}")
+        return None
+    if not got_data:
+        return None  # probablemente la tabla la pinta JS: mejor el navegador
+    return frames
+
+MEDIA_COLS = {"nombre","medio","site","sitio","dominio","brand","marca","titulo","name"}
+
+def media_column(df: pd.DataFrame) -> str:
+    """Columna con el nombre del medio (o la primera si no hay ninguna reconocible)."""
+    candidates = [c for c in df.columns if norm(c) in MEDIA_COLS]
+    return candidates[0] if candidates else df.columns[0]
+
+def scrape_date(page, dt: datetime) -> tuple[datetime, pd.DataFrame | list[list]]:
+    """
+    Fija la fecha, busca y devuelve (fecha real de la página, salida filtrada; lista de
+    filas en modo LEAN). Una salida vacía significa NO HAY DATOS para esa fecha.
+    """
+    with (record_feed(page) if CAPTURE_FEED else nullcontext([])) as responses:
+        with stage("set_date_and_search"):
+            ok = set_date_and_search(page, dt)
+    if not ok:
+        print(f"[ERR] No fue posible preparar el filtro de fecha {ymd(dt)}.")
+        return dt, [] if LEAN else pd.DataFrame()
+
+    # Leemos la **fecha real** que usa la página
+    real_dt = read_final_date_from_page(page) or dt
+    print(f"[INFO] Fecha confirmada en página: {ymd(real_dt)}")
+
+    if LEAN:
+        with stage("read_table"):
+            cells = read_cells_all_pages(page)
+        return real_dt, shape_rows(cells, real_dt)
+
+    df = table_from_feed(feed_payloads(responses)) if CAPTURE_FEED else pd.DataFrame()
+    if df.empty:
+        with stage("read_table"):
+            df = read_table_all_pages(page)
+    return real_dt, shape_table(df, real_dt)
+
+ALL_MEDIA_FRAMES: list[pd.DataFrame] = []  # tablas completas de la ejecución (modo ALL_MEDIA)
+
+def shape_table(df: pd.DataFrame, real_dt: datetime) -> pd.DataFrame:
+    """Tabla leída -> salida filtrada por medios (vacía = NO HAY DATOS)."""
+    if df.empty:
+        print("[INFO] No se pudo leer una tabla válida ⇒ NO HAY DATOS.")
         return pd.DataFrame()
-    if not tables: return pd.DataFrame()
-    t = pick_table(tables)
-    return t if t is not None else pd.DataFrame()
 
-# ========================== MAIN ==========================
-def run():
-    print("[START] ojd_export.py")
+    media_col = media_column(df)
+    with stage("shape_output"):
+        if ALL_MEDIA:
+            ALL_MEDIA_FRAMES.append(shape_all(df, media_col, real_dt))
+        out = shape_output(df, media_col, real_dt)
+    if out.empty:
+        print("[INFO] Tras filtro de medios, no hay filas ⇒ NO HAY DATOS.")
+    return out
 
-    # Fecha objetivo base
-    tgt = default_target_dt()
-    # Si hay FORCE_DATE, usamos esa
-    if FORCE_DATE_STR:
-        forced = parse_dmy(FORCE_DATE_STR)
-        if forced: tgt = forced
-        print(f"[INFO] FORCE_DATE_DDMMYYYY='{FORCE_DATE_STR}' -> objetivo {ymd(tgt)}")
-    else:
-        print(f"[INFO] Fecha objetivo (hoy-2): {ymd(tgt)}")
+def shape_rows(t: Cells, real_dt: datetime) -> list[list]:
+    """
+    shape_table sin pandas (modo LEAN): filas [Fecha, Nombre, NU, Visitas, PV] de los
+    medios del catálogo, en su orden, con "" donde falta un número (vacía = NO HAY DATOS).
+    """
+    if t.empty:
+        print("[INFO] No se pudo leer una tabla válida ⇒ NO HAY DATOS.")
+        return []
+    media_i = t.columns.index(media_column(t))
+    metric_i = [t.columns.index(c) if c else None for c in metric_columns(t)]
+    fecha, out = ymd(real_dt), []
+    with stage("shape_output"):
+        for r in t.rows:
+            name = canonical_name(r[media_i])
+            if name is None: continue
+            nums = [to_int(r[i]) if i is not None else None for i in metric_i]
+            out.append([fecha, name] + ["" if v is None else v for v in nums])
+        out.sort(key=lambda r: ORDER_INDEX.get(r[1], 999))
+    if not out:
+        print("[INFO] Tras filtro de medios, no hay filas ⇒ NO HAY DATOS.")
+    return out
+
+def frame_for_date(page, dt: datetime) -> pd.DataFrame:
+    """scrape_date, pero sustituyendo la salida vacía por la fila 'NO HAY DATOS'."""
+    real_dt, out = scrape_date(page, dt)
+    return out if not out.empty else no_data_frame(real_dt)
+
+def date_failed(dt: datetime, e: Exception) -> pd.DataFrame:
+    """Un error en una fecha del backfill (timeout, goto fallido…) no tira el resto: 'NO HAY DATOS'."""
+    print(f"[WARN] {ymd(dt)}: {type(e).__name__}: {e}")
+    count("date_failed")
+    return no_data_frame(dt)
+
+def frame_for_date_safe(page, dt: datetime) -> pd.DataFrame:
+    try:
+        return frame_for_date(page, dt)
+    except Exception as e:
+        return date_failed(dt, e)
+
+def _backfill_worker(state: dict, q: queue.Queue, results: dict):
+    """
+    Un hilo = un Playwright + un contexto con la sesión compartida; consume fechas de la cola.
+    Si el arranque falla, el hilo termina sin tocar la cola y sus fechas las leen los demás.
+    """
+    try:
+        with sync_playwright() as p:
+            with stage("chromium_launch"):
+                browser = p.chromium.launch(headless=True)
+            try:
+                page = new_context(browser, storage_state=state).new_page()
+                while True:
+                    try:
+                        dt = q.get_nowait()
+                    except queue.Empty:
+                        break
+                    results[dt] = frame_for_date_safe(page, dt)
+            finally:
+                browser.close()
+    except Exception as e:
+        print(f"[WARN] Hilo de backfill caído ({type(e).__name__}: {e})")
+        count("backfill_worker_failed")
 
+def scrape_parallel(state: dict, dates: list[datetime], workers: int) -> list[pd.DataFrame]:
+    """Reparte las fechas entre `workers` contextos; devuelve los frames en el orden de `dates`."""
+    q = queue.Queue()
+    for dt in dates: q.put(dt)
+    results = {}
+    threads = [threading.Thread(target=_backfill_worker, args=(state, q, results), daemon=True)
+               for _ in range(workers)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    missing = [dt for dt in dates if dt not in results]
+    if missing:
+        # Todos los hilos cayeron antes de vaciar la cola: no se pierde el resto del backfill
+        print(f"[WARN] {len(missing)} fechas sin leer ({ymd(missing[0])}…) ⇒ NO HAY DATOS.")
+        count("backfill_missing", len(missing))
+    return [results[dt] if dt in results else no_data_frame(dt) for dt in dates]
+
+# ========================== MAIN ==========================
+def run_backfill(dates: list[datetime]):
+    """Un solo login para todas las fechas; una sola escritura al final."""
+    workers = min(BACKFILL_WORKERS, BACKFILL_MAX_BROWSERS, len(dates))
+    if BACKFILL_WORKERS > BACKFILL_MAX_BROWSERS:
+        print(f"[WARN] BACKFILL_WORKERS={BACKFILL_WORKERS} ⇒ {BACKFILL_MAX_BROWSERS} navegadores (BACKFILL_MAX_BROWSERS)")
+    print(f"[INFO] Backfill {ymd(dates[0])} -> {ymd(dates[-1])} ({len(dates)} fechas, {workers} contextos)")
     with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context(accept_downloads=True)
-        page = context.new_page()
+        with stage("chromium_launch"):
+            browser = p.chromium.launch(headless=True)
+        with stage("login"):
+            context, page = open_session(browser)
+        if workers == 1:
+            frames = [frame_for_date_safe(page, dt) for dt in dates]
+        else:
+            state = context.storage_state()
+        browser.close()
 
-        # 1) Login
-        login_tm(page)
+    # Cada hilo necesita su propio sync_playwright: se lanzan con la sesión ya capturada
+    if workers > 1:
+        frames = scrape_parallel(state, dates, workers)
+    report_blocking()
 
-        # 2) Fijar fecha exacta en #datepicker y Buscar
-        ok = set_date_and_search(page, tgt)
-        if not ok:
-            print("[ERR] No fue posible preparar el filtro de fecha.")
-            write_no_data_overwrite(tgt)
-            browser.close()
-            return
+    write_replace_all(pd.concat(frames, ignore_index=True))
+    print(f"[DONE] OK ({len(frames)} fechas)")
 
-        # 3) Leemos la **fecha real** que usa la página
-        real_dt = read_final_date_from_page(page) or tgt
-        print(f"[INFO] Fecha confirmada en página: {ymd(real_dt)}")
+def run():
+    """run_pipeline con métricas por etapa y el informe JSON en debug/ (también si falla)."""
+    started, t0, status = tz_now(), time.perf_counter(), "ok"
+    try:
+        run_pipeline()
+    except BaseException as e:
+        status = f"error: {type(e).__name__}: {e}"
+        raise
+    finally:
+        path = write_run_report(started, time.perf_counter() - t0, status)
+        print(f"[REPORT] {path}")
 
-        # 4) Leer tabla
-        df = read_table(page)
-        if df.empty:
-            print("[INFO] No se pudo leer una tabla válida ⇒ NO HAY DATOS.")
-            write_no_data_overwrite(real_dt)
-            browser.close()
+def run_pipeline():
+    print("[START] ojd_export.py")
+
+    if BACKFILL_RANGE:
+        dates = parse_range(BACKFILL_RANGE)
+        if not dates:
+            print(f"[ERR] BACKFILL_RANGE='{BACKFILL_RANGE}' no válido (dd/mm/yyyy-dd/mm/yyyy).")
             return
+    else:
+        # Fecha objetivo base
+        tgt = default_target_dt()
+        # Si hay FORCE_DATE, usamos esa
+        if FORCE_DATE_STR:
+            forced = parse_dmy(FORCE_DATE_STR)
+            if forced: tgt = forced
+            print(f"[INFO] FORCE_DATE_DDMMYYYY='{FORCE_DATE_STR}' -> objetivo {ymd(tgt)}")
+        else:
+            print(f"[INFO] Fecha objetivo (hoy-2): {ymd(tgt)}")
+            # Doble cron (CET/CEST): la segunda ejecución sale sin lanzar Chromium
+            if not FORCE_WRITE and already_published(tgt):
+                print(f"[SKIP] {ymd(tgt)} ya está publicado (ledger local); nada que hacer.")
+                return
+        dates = [tgt]
 
-        # 5) Determinar columna de medio
-        candidates = [c for c in df.columns if norm(c) in {
-            "nombre","medio","site","sitio","dominio","brand","marca","titulo","name"
-        }]
-        media_col = candidates[0] if candidates else df.columns[0]
+    if not OJD_USER or not OJD_PASS:
+        raise SystemExit("[ERR] Faltan OJD_USER / OJD_PASS.")
+    prefetch_ws()
 
-        out = shape_output(df, media_col, real_dt)
-        if out.empty:
-            print("[INFO] Tras filtro de medios, no hay filas ⇒ NO HAY DATOS.")
-            write_no_data_overwrite(real_dt)
-            browser.close()
+    if OJD_BACKEND == "http":
+        with stage("http_scrape"):
+            frames = scrape_http(dates)
+        if frames is not None:
+            write_frames(frames)
+            print(f"[DONE] OK ({len(frames)} fechas, HTTP)")
             return
+        print("[HTTP][WARN] Modo HTTP sin datos -> se usa Playwright.")
+        count("http_fallback")
 
-        # 6) **SOBREESCRIBIR** en la base con los datos actuales
-        write_replace_all(out)
+    if OJD_ENGINE == "async":
+        asyncio.run(run_async(dates))
+        return
+    if BACKFILL_RANGE:
+        run_backfill(dates)
+        return
 
+    with sync_playwright() as p:
+        with stage("chromium_launch"):
+            browser = p.chromium.launch(headless=True)
+
+        # 1) Login (o sesión cacheada)
+        with stage("login"):
+            context, page = open_session(browser)
+
+        # 2) Fecha + Buscar, fecha real y tabla ya filtrada por medios
+        real_dt, out = scrape_date(page, tgt)
         browser.close()
-        print("[DONE] OK")
+    report_blocking()
+
+    if not len(out):
+        write_no_data_overwrite(real_dt)
+        return
+
+    # 3) **SOBREESCRIBIR** en la base con los datos actuales
+    write_frames([out])
+    print("[DONE] OK")
 
 if __name__ == "__main__":
     run()